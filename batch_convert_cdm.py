@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+
+import os
+import glob
+import time
+import logging
+import argparse
+import multiprocessing
+
+import saxon_worker
+import convert_cdm_to_mods
+from saxon_worker import count_cpus
+from utilities import setup_logging
+
+
+def main(aliases, cdm_data_dir, processes=None, saxon_debug=False, incremental=False, reproducible=False, prometheus_dir=None,
+         full_scan=False):
+    # biggest collections first, so one large alias doesn't start last and run alone
+    aliases = sorted(set(aliases), key=lambda alias: estimate_size(cdm_data_dir, alias), reverse=True)
+    processes = max(1, min(processes or count_cpus(), len(aliases)))
+    jobs = [(alias, cdm_data_dir, saxon_debug, incremental, reproducible, prometheus_dir, full_scan) for alias in aliases]
+    logging.info('converting {} aliases with {} processes'.format(len(aliases), processes))
+
+    results = []
+    if processes == 1:
+        init_batch_worker(processes)
+        results = [convert_one_alias(job) for job in jobs]
+    else:
+        # the processes live for the whole batch: each keeps its compiled schema and its saxon jvms
+        # (with their compiled stylesheets) from one alias to the next
+        with multiprocessing.Pool(processes, initializer=init_batch_worker, initargs=(processes, )) as pool:
+            for result in pool.imap_unordered(convert_one_alias, jobs):
+                alias, error, seconds = result
+                logging.info('{} {} after {:.0f}s'.format(alias, 'FAILED' if error else 'finished', seconds))
+                results.append(result)
+            pool.close()
+            pool.join()
+
+    failures = sorted((alias, error) for alias, error, _ in results if error)
+    for alias, error in failures:
+        logging.warning('{} failed: {}'.format(alias, error))
+    logging.info('{} of {} aliases converted'.format(len(results) - len(failures), len(results)))
+    return failures
+
+
+def find_all_aliases(cdm_data_dir):
+    # every alias with a mapping file, an alias_xslts list, and cached data
+    mapped = {os.path.splitext(os.path.basename(i))[0] for i in glob.glob(os.path.join('mappings_files', '*.csv'))}
+    with_xslts = {os.path.splitext(os.path.basename(i))[0] for i in glob.glob(os.path.join('alias_xslts', '*.txt'))}
+    aliases = []
+    for alias in sorted(mapped & with_xslts):
+        if os.path.isdir(os.path.join(cdm_data_dir, alias)):
+            aliases.append(alias)
+        else:
+            logging.info('skipping {}: not in {}'.format(alias, cdm_data_dir))
+    return aliases
+
+
+def estimate_size(cdm_data_dir, alias):
+    return sum(os.path.getsize(i) for i in glob.glob(os.path.join(cdm_data_dir, alias, 'Elems_in_Collection*.json')))
+
+
+class AliasLogFilter(logging.Filter):
+    # tags each message with the alias being converted, since several aliases share the console and log.txt
+    alias = None
+
+    def filter(self, record):
+        if self.alias:
+            record.msg = '{}: {}'.format(self.alias, record.msg)
+        return True
+
+
+alias_log_filter = AliasLogFilter()
+
+
+def init_batch_worker(processes):
+    saxon_worker.MAX_SHARDS = max(1, count_cpus() // processes)
+    logging.getLogger('').addFilter(alias_log_filter)
+
+
+def convert_one_alias(job):
+    alias, cdm_data_dir, saxon_debug, incremental, reproducible, prometheus_dir, full_scan = job
+    start = time.time()
+    alias_log_filter.alias = alias
+    try:
+        convert_cdm_to_mods.main(alias, cdm_data_dir, workers=1, saxon_debug=saxon_debug, incremental=incremental,
+                                 reproducible=reproducible, prometheus_dir=prometheus_dir, full_scan=full_scan)
+        error = None
+    except SystemExit:
+        error = 'conversion halted, see the log'
+    except Exception as e:
+        logging.exception('unexpected error')
+        error = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        alias_log_filter.alias = None
+    return alias, error, time.time() - start
+
+
+if __name__ == '__main__':
+    setup_logging()
+    parser = argparse.ArgumentParser(usage='python batch_convert_cdm.py $path/to/Cached_Cdm_files (--all | $alias1 $alias2 ...) [--processes N]')
+    parser.add_argument('cdm_data_dir')
+    parser.add_argument('aliases', nargs='*')
+    parser.add_argument('--all', action='store_true', help='every alias with a mapping file and an alias_xslts entry')
+    parser.add_argument('--processes', type=int, default=None, help='aliases converted at once (default: one per core)')
+    parser.add_argument('--saxon-debug', action='store_true', help='run one saxon per xslt and keep each step in its own folder')
+    parser.add_argument('--incremental', action='store_true', help='only rebuild pointers whose source changed since the last run')
+    parser.add_argument('--reproducible', action='store_true', help="timestamp dmGetItemInfo with the cached json's mtime instead of now")
+    parser.add_argument('--prometheus-dir', default=None, help="also write each alias's run report as a prometheus textfile in this folder")
+    parser.add_argument('--full-scan', action='store_true', help='restat every cached file, to catch files edited in place in folders that look unchanged')
+    args = parser.parse_args()
+    aliases = find_all_aliases(args.cdm_data_dir) if args.all else args.aliases
+    if not aliases:
+        parser.error('name some aliases, or use --all')
+    failures = main(aliases, args.cdm_data_dir, processes=args.processes, saxon_debug=args.saxon_debug,
+                    incremental=args.incremental, reproducible=args.reproducible, prometheus_dir=args.prometheus_dir,
+                    full_scan=args.full_scan)
+    if failures:
+        raise SystemExit(1)
@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+
+# Compares utilities.merge_same_fields with the nested sibling scan it replaced,
+# on synthetic mods records with many repeated top level fields.
+#
+#     python3 benchmarks/bench_merge_same_fields.py [--fields 25 100 400] [--repeat 20]
+
+import os
+import sys
+import random
+import timeit
+import argparse
+from copy import deepcopy
+
+from lxml import etree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utilities import merge_same_fields
+
+
+def legacy_merge_same_fields(orig_etree):
+    for elem in orig_etree:
+        for following_elem in elem.itersiblings():
+            if elem.tag == following_elem.tag and elem.attrib == following_elem.attrib:
+                for child in following_elem.iterchildren():
+                    elem.insert(-1, child)
+    return orig_etree
+
+
+def make_record(num_fields, seed):
+    rand = random.Random(seed)
+    fields = (('subject', 'topic'), ('subject', 'geographic'), ('name', 'namePart'), ('note', None),
+              ('originInfo', 'dateIssued'), ('physicalDescription', 'extent'), ('genre', None), )
+    attribs = ({}, {'authority': 'lcsh'}, {'type': 'personal'}, {'displayLabel': 'Format'}, )
+    mods = ET.Element('mods')
+    for num in range(num_fields):
+        tag, child_tag = rand.choice(fields)
+        elem = ET.SubElement(mods, tag, attrib=rand.choice(attribs))
+        if child_tag is None:
+            elem.text = 'field {}'.format(num)
+            continue
+        for i in range(rand.randint(0, 3)):
+            ET.SubElement(elem, child_tag).text = 'field {} value {}'.format(num, i)
+    return mods
+
+
+def main(field_counts, repeat):
+    print('{:>8} {:>12} {:>12} {:>8}'.format('fields', 'legacy ms', 'grouped ms', 'speedup'))
+    for num_fields in field_counts:
+        record = make_record(num_fields, num_fields)
+        if ET.tostring(legacy_merge_same_fields(deepcopy(record))) != ET.tostring(merge_same_fields(deepcopy(record))):
+            sys.exit('merge_same_fields output differs from the legacy version at {} fields'.format(num_fields))
+        copies = [deepcopy(record) for _ in range(repeat)]
+        legacy = timeit.timeit(lambda: legacy_merge_same_fields(copies.pop()), number=repeat) / repeat
+        copies = [deepcopy(record) for _ in range(repeat)]
+        grouped = timeit.timeit(lambda: merge_same_fields(copies.pop()), number=repeat) / repeat
+        print('{:>8} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(num_fields, legacy * 1000, grouped * 1000, legacy / grouped))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fields', type=int, nargs='+', default=[25, 100, 400, 1600])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    main(args.fields, args.repeat)
@@ -0,0 +1,183 @@
+#! /usr/bin/env python3
+
+# Times every stage of convert_cdm_to_mods.main and post_cdm_cleanup.main on synthetic
+# collections (benchmarks/make_synthetic_cdm.py), and saves the timings for later comparison.
+#
+#     python3 benchmarks/bench_pipeline.py [--items 1000 10000 100000] [--workers 4] [--compare benchmarks/results/old.json]
+#
+# Each size runs in its own process, in a scratch folder holding links to schema/, xsl/ and
+# the saxon jar, so nothing under output/ or Upload_to_Islandora/ is touched.
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import platform
+import subprocess
+import multiprocessing
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import make_synthetic_cdm
+
+# post_cdm_cleanup only packages aliases it can find an institution for
+ALIAS = 'p16313coll97'
+SHARED_RESOURCES = ('schema', 'xsl', 'java', 'saxon9he.jar', )
+CONVERT_STAGES = ('remove_previous_mods', 'remove_intermediate_mods', 'make_nicks_to_names', 'CdmPathIndex',
+                  'parse_root_cdm_pointers', 'parse_parents_children', 'MonographTitleCombiner', 'make_all_mods',
+                  'run_saxon', 'audit_mods', 'IsCountsCorrect', 'fix_permissions', )
+CLEANUP_STAGES = ('CdmPathIndex', 'PullInBinaries', 'MakeStructureFile', 'IsCountsCorrect', 'report_restricted_files',
+                  'report_filetype', 'group_by_extension', 'make_zips', 'write_zips', 'fix_permissions', 'cleanup_leftover_files', )
+
+
+def main(item_counts, like, workers=1, compound_share=0.2, children=9, keep=False, compare=None):
+    results = {'commit': git_commit(),
+               'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'cpus': multiprocessing.cpu_count(),
+               'args': {'like': like, 'workers': workers, 'compound_share': compound_share, 'children': children},
+               'runs': [], }
+    for items in item_counts:
+        logging.info('benchmarking {} items'.format(items))
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_one_size,
+                                          args=(queue, items, like, workers, compound_share, children, keep))
+        process.start()
+        run = queue.get()
+        process.join()
+        results['runs'].append(run)
+        print_run(run)
+
+    results_dir = os.path.join(REPO_DIR, 'benchmarks', 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    results_path = os.path.join(results_dir, 'pipeline-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+    with open(results_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(results, indent=1))
+    logging.info('results saved to {}'.format(results_path))
+    if compare:
+        print_comparison(compare, results)
+    return results
+
+
+def run_one_size(queue, items, like, workers, compound_share, children, keep):
+    work_dir = tempfile.mkdtemp(prefix='bench_pipeline_{}_'.format(items))
+    run = {'items': items, 'work_dir': work_dir, 'stages': {}}
+    try:
+        make_work_dir(work_dir, like)
+        os.chdir(work_dir)
+        compounds = int(items * compound_share) // (children + 1)
+        simples = items - compounds * (children + 1)
+        start = time.time()
+        make_synthetic_cdm.main('Cached_Cdm_files', alias=ALIAS, like=ALIAS, simples=simples,
+                                compounds=compounds, children=children)
+        run.update({'simples': simples, 'compounds': compounds, 'generate_seconds': time.time() - start})
+
+        import convert_cdm_to_mods
+        import post_cdm_cleanup
+        time_stages(convert_cdm_to_mods, 'convert', CONVERT_STAGES, run['stages'])
+        time_stages(post_cdm_cleanup, 'cleanup', CLEANUP_STAGES, run['stages'])
+        for step, module, kwargs in (('convert', convert_cdm_to_mods, {'workers': workers}),
+                                     ('cleanup', post_cdm_cleanup, {})):
+            start = time.time()
+            module.main(ALIAS, 'Cached_Cdm_files', **kwargs)
+            run['{}_seconds'.format(step)] = time.time() - start
+        run['items_per_second'] = items / (run['convert_seconds'] + run['cleanup_seconds'])
+    except SystemExit:
+        run['error'] = 'the pipeline halted, see the log above'
+    except Exception as e:
+        logging.exception('benchmark failed')
+        run['error'] = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        os.chdir(REPO_DIR)
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        queue.put(run)
+
+
+def make_work_dir(work_dir, like):
+    for name in SHARED_RESOURCES:
+        if os.path.exists(os.path.join(REPO_DIR, name)):
+            os.symlink(os.path.join(REPO_DIR, name), os.path.join(work_dir, name))
+    for folder, extension in (('mappings_files', 'csv'), ('alias_xslts', 'txt')):
+        os.makedirs(os.path.join(work_dir, folder))
+        shutil.copyfile(os.path.join(REPO_DIR, folder, '{}.{}'.format(like, extension)),
+                        os.path.join(work_dir, folder, '{}.{}'.format(ALIAS, extension)))
+
+
+def time_stages(module, prefix, names, stages):
+    for name in names:
+        if hasattr(module, name):
+            setattr(module, name, timed(getattr(module, name), '{}.{}'.format(prefix, name), stages))
+
+
+def timed(func, label, stages):
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stage = stages.setdefault(label, {'seconds': 0.0, 'calls': 0})
+            stage['seconds'] += time.time() - start
+            stage['calls'] += 1
+    return wrapper
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_run(run):
+    if 'error' in run:
+        print('{} items: {}'.format(run['items'], run['error']))
+        return
+    print('{} items ({} simples, {} compounds): convert {:.1f}s, cleanup {:.1f}s, {:.0f} items/s'.format(
+        run['items'], run['simples'], run['compounds'], run['convert_seconds'], run['cleanup_seconds'], run['items_per_second']))
+    for label, stage in sorted(run['stages'].items(), key=lambda i: -i[1]['seconds']):
+        print('    {:<36} {:>9.3f}s {:>4} calls'.format(label, stage['seconds'], stage['calls']))
+
+
+def print_comparison(old_path, results):
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old_results = json.loads(f.read())
+    old_runs = {run['items']: run for run in old_results['runs'] if 'error' not in run}
+    print('compared with {} (commit {})'.format(old_path, old_results.get('commit')))
+    for run in results['runs']:
+        old_run = old_runs.get(run['items'])
+        if old_run is None or 'error' in run:
+            continue
+        print('{} items: {:.0f} -> {:.0f} items/s'.format(run['items'], old_run['items_per_second'], run['items_per_second']))
+        for label in sorted(set(run['stages']) | set(old_run['stages'])):
+            old = old_run['stages'].get(label, {}).get('seconds')
+            new = run['stages'].get(label, {}).get('seconds')
+            if old is None or new is None:
+                print('    {:<36} {:>9} -> {:>9}'.format(label, fmt_seconds(old), fmt_seconds(new)))
+            else:
+                print('    {:<36} {:>9} -> {:>9} {:>7.2f}x'.format(label, fmt_seconds(old), fmt_seconds(new), old / max(new, 1e-9)))
+
+
+def fmt_seconds(seconds):
+    return '-' if seconds is None else '{:.3f}s'.format(seconds)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, nargs='+', default=[1000, 10000], help='collection sizes to run, e.g. 1000 10000 100000')
+    parser.add_argument('--like', default='AAW', help='use the mapping file and alias_xslts list of this alias')
+    parser.add_argument('--workers', type=int, default=1, help='passed to convert_cdm_to_mods.main')
+    parser.add_argument('--compound-share', type=float, default=0.2, help='share of the items that are in compounds')
+    parser.add_argument('--children', type=int, default=9, help='children per compound')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch folders')
+    parser.add_argument('--compare', default=None, help='a previous results file to compare each stage with')
+    args = parser.parse_args()
+    main(args.items, args.like, workers=args.workers, compound_share=args.compound_share,
+         children=args.children, keep=args.keep, compare=args.compare)
@@ -0,0 +1,51 @@
+#! /usr/bin/env python3
+
+# Times a fresh interpreter importing each script, and compiling the mods schema,
+# which now waits until the first file is validated.
+#
+#     python3 benchmarks/bench_startup.py [--repeat 10]
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ('utilities', 'post_cdm_cleanup', 'post_xlsx_cleanup', 'convert_cdm_to_mods', 'convert_xlsx_to_mods', 'batch_convert_cdm', )
+TIMER = """
+import time
+start = time.perf_counter()
+{}
+print(time.perf_counter() - start)
+"""
+
+
+def main(repeat):
+    baseline = time_snippet('pass', repeat)
+    print('{:<28} {:>10} {:>10}'.format('', 'median ms', 'min ms'))
+    print('{:<28} {:>10.1f} {:>10.1f}'.format('interpreter only', statistics.median(baseline) * 1000, min(baseline) * 1000))
+    for module in MODULES:
+        seconds = time_snippet('import {}'.format(module), repeat)
+        print('{:<28} {:>10.1f} {:>10.1f}'.format('import ' + module, statistics.median(seconds) * 1000, min(seconds) * 1000))
+    seconds = time_snippet('import mods_audit; mods_audit.mods_schema()', repeat)
+    print('{:<28} {:>10.1f} {:>10.1f}'.format('import + compile schema', statistics.median(seconds) * 1000, min(seconds) * 1000))
+    print('openpyxl imported by convert_cdm_to_mods: {}'.format(
+        run_snippet("import sys, convert_cdm_to_mods\nprint('openpyxl' in sys.modules)")))
+
+
+def time_snippet(snippet, repeat):
+    return [float(run_snippet(TIMER.format(snippet))) for _ in range(repeat)]
+
+
+def run_snippet(code):
+    # a new process each time, so nothing is already imported
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=REPO_DIR)
+    return output.decode('utf-8').strip().splitlines()[-1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    main(args.repeat)
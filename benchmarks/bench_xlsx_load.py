@@ -0,0 +1,159 @@
+#! /usr/bin/env python3
+
+# Compares loading a big spreadsheet the old way (openpyxl's full mode, every cell built up front)
+# with utilities.parse_xlsx_file's streaming read_only mode, and with the same sheets exported as
+# csv, tsv and jsonl folders for utilities.parse_plain_source: time, rows/s, tracemalloc peak and peak rss.
+#
+#     python3 benchmarks/bench_xlsx_load.py [--rows 100000] [--columns 30] [--transcript-chars 2000] [--keep]
+#
+# Each loader runs in a fresh process, so one's memory doesn't count against the other.
+
+import os
+import sys
+import json
+import time
+import csv
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+LOADERS = ('full', 'streaming', 'csv', 'tsv', 'jsonl', )
+WORDS = ('river', 'parish', 'levee', 'cotton', 'steamboat', 'bayou', 'cathedral', 'market', 'street', 'railroad', )
+
+
+def main(rows, columns, transcript_chars, children, keep=False):
+    work_dir = tempfile.mkdtemp(prefix='bench_xlsx_load_')
+    try:
+        xlsx_path = os.path.join(work_dir, 'CollectionBench.xlsx')
+        start = time.time()
+        sheets = make_sheets(rows, columns, transcript_chars, children)
+        make_workbook(xlsx_path, sheets)
+        for extension in ('csv', 'tsv', 'jsonl'):
+            make_plain_source(os.path.join(work_dir, extension, 'CollectionBench'), extension, sheets)
+        print('{} rows x {} columns, {:.1f} MB of xlsx, written in {:.1f}s'.format(
+            rows, columns, os.path.getsize(xlsx_path) / 1e6, time.time() - start))
+        print('{:<10} {:>10} {:>10} {:>18} {:>14}'.format('loader', 'seconds', 'rows/s', 'tracemalloc MB', 'peak rss MB'))
+        for loader in LOADERS:
+            source = xlsx_path if loader in ('full', 'streaming') else os.path.join(work_dir, loader, 'CollectionBench')
+            # run in the scratch folder, so parse_xlsx_file's snapshot lands there and a rerun can't read one
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--measure', loader, source], cwd=work_dir)
+            result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+            print('{:<10} {:>10.2f} {:>10.0f} {:>18.1f} {:>14.1f}'.format(
+                loader, result['seconds'], rows / result['seconds'], result['tracemalloc_peak'] / 1e6, result['peak_rss_kb'] / 1024))
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def make_sheets(rows, columns, transcript_chars, children):
+    rand = random.Random(1)
+    headers = ['Identifier', 'Child', 'Title', 'Directory', 'File Name', 'Transcript']
+    headers.extend('Field {}'.format(i) for i in range(max(columns - len(headers), 0)))
+    metadata = [headers]
+    identifier = 0
+    while len(metadata) <= rows:
+        identifier += 1
+        pages = children if rand.random() < 0.1 else 0
+        for child in range(pages + 1):
+            values = ['item{}'.format(identifier), child or None, 'Item {}'.format(identifier), 'binaries',
+                      'item{}_{}.jp2'.format(identifier, child), make_text(transcript_chars, rand)]
+            values.extend(make_text(20, rand) for _ in headers[6:])
+            metadata.append(values)
+    return {'Mappings': [[header, '<note>%value%</note>'] for header in headers],
+            'Metadata': metadata,
+            'Xsls': [['blankNodes']], }
+
+
+def make_workbook(xlsx_path, sheets):
+    # write_only, so building the test file doesn't need the memory being measured
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, sheet_rows in sheets.items():
+        sheet = workbook.create_sheet(name)
+        for row in sheet_rows:
+            sheet.append(row)
+    workbook.save(xlsx_path)
+
+
+def make_plain_source(folder, extension, sheets):
+    os.makedirs(folder)
+    for name, sheet_rows in sheets.items():
+        with open(os.path.join(folder, '{}.{}'.format(name, extension)), 'w', encoding='utf-8', newline='') as f:
+            if extension == 'jsonl' and name == 'Metadata':
+                headers = sheet_rows[0]
+                for row in sheet_rows[1:]:
+                    f.write(json.dumps(dict(zip(headers, row))) + '\n')
+            elif extension == 'jsonl':
+                for row in sheet_rows:
+                    f.write(json.dumps(row) + '\n')
+            else:
+                writer = csv.writer(f, delimiter='\t' if extension == 'tsv' else ',')
+                writer.writerows([['' if i is None else i for i in row] for row in sheet_rows])
+
+
+def make_text(chars, rand):
+    words, length = [], 0
+    while length < chars:
+        words.append(rand.choice(WORDS))
+        length += len(words[-1]) + 1
+    return ' '.join(words)
+
+
+def measure(loader, xlsx_path):
+    from utilities import group_by_simple_cpd
+    tracemalloc.start()
+    start = time.time()
+    if loader == 'full':
+        metadata = load_full(xlsx_path)
+    else:
+        from utilities import parse_source
+        _, metadata, _ = parse_source(xlsx_path)
+    simples, compounds = group_by_simple_cpd(metadata)
+    seconds = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    print(json.dumps({'seconds': seconds,
+                      'tracemalloc_peak': peak,
+                      'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      'simples': len(simples),
+                      'compounds': len(compounds), }))
+
+
+def load_full(xlsx_path):
+    # what parse_xlsx_file and parse_metadata did before they streamed
+    import openpyxl
+    from utilities import shorten
+    workbook = openpyxl.load_workbook(xlsx_path)
+    sheet = workbook['Metadata']
+    row_1 = [i for i in sheet.iter_rows(min_row=1, max_row=1)][0]
+    max_columns = len({cell.value for cell in row_1}) - 1
+    metadata = dict()
+    for row_num, row in enumerate(sheet.iter_rows(max_col=max_columns)):
+        if row_num == 0:
+            headers = [shorten(i.value) for i in row]
+            continue
+        item = dict(zip(headers, (i.value for i in row)))
+        item["Row"] = row_num + 1
+        metadata[row_num + 1] = item
+    return [item for row_num, item in sorted(metadata.items())]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=30)
+    parser.add_argument('--transcript-chars', type=int, default=2000, help='characters in the Transcript column')
+    parser.add_argument('--children', type=int, default=10, help='children of the one row in ten that is a compound')
+    parser.add_argument('--keep', action='store_true', help='keep the generated spreadsheet')
+    parser.add_argument('--measure', nargs=2, metavar=('LOADER', 'XLSX'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure)
+    else:
+        main(args.rows, args.columns, args.transcript_chars, args.children, keep=args.keep)
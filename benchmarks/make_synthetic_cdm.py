@@ -0,0 +1,171 @@
+#! /usr/bin/env python3
+
+# Writes a fake Cached_Cdm_files/{alias} tree shaped like a cdm_xporter download:
+# Collection_Fields.json, paged Elems_in_Collection_{n}.json, Simple/{pointer}.json,
+# Cpd/{pointer}.json + {pointer}_cpd.xml, Cpd/{pointer}/{child}.json, and placeholder binaries.
+#
+#     python3 benchmarks/make_synthetic_cdm.py path/to/Cached_Cdm_files --simples 900 --compounds 10 --children 9
+#
+# The fields come from a real mapping file (--like), so the mods built from the fake
+# records are as wide as that collection's.
+
+import os
+import csv
+import json
+import random
+import argparse
+
+
+WORDS = ('river', 'parish', 'levee', 'cotton', 'steamboat', 'bayou', 'cathedral', 'market', 'street', 'railroad',
+         'portrait', 'family', 'school', 'church', 'harbor', 'festival', 'plantation', 'hospital', 'bridge', 'storm',
+         'Baton Rouge', 'New Orleans', 'Shreveport', 'Lafayette', 'Natchitoches', 'Monroe', 'Alexandria', 'Houma', )
+NAMES = ('Smith, John', 'Boudreaux, Marie', 'Landry, Paul', 'Broussard, Anne', 'Thibodeaux, Louis', 'Hebert, Claire',
+         'Guidry, Henri', 'Fontenot, Rose', )
+DEFAULT_FIELDS = ('Title', 'Creator', 'Subject', 'Coverage', 'Date', 'Description', 'Language', 'Rights', )
+BINARY_TYPES = ('jp2', 'jp2', 'jp2', 'pdf', 'mp3', )
+
+
+def main(cdm_data_dir, alias='p16313coll97', like=None, simples=1000, compounds=0, children=10,
+         monograph_share=0.5, monograph_depth=2, field_width=200, page_size=1000, binary_size=1024, seed=1):
+    rand = random.Random(seed)
+    alias_dir = os.path.join(cdm_data_dir, alias)
+    os.makedirs(os.path.join(alias_dir, 'Simple'), exist_ok=True)
+    os.makedirs(os.path.join(alias_dir, 'Cpd'), exist_ok=True)
+    fields = make_fields(mapping_field_names(like) if like else DEFAULT_FIELDS)
+    write_json(os.path.join(alias_dir, 'Collection_Fields.json'), fields)
+
+    records = []
+    pointer = 0
+    for _ in range(simples):
+        pointer += 1
+        filetype = rand.choice(BINARY_TYPES)
+        records.append({'pointer': pointer, 'dmrecord': str(pointer), 'filetype': filetype})
+        write_item(os.path.join(alias_dir, 'Simple'), pointer, fields, filetype, field_width, binary_size, rand)
+    for _ in range(compounds):
+        pointer += 1
+        parent = pointer
+        records.append({'pointer': parent, 'dmrecord': str(parent), 'filetype': 'cpd'})
+        write_item(os.path.join(alias_dir, 'Cpd'), parent, fields, 'cpd', field_width, 0, rand)
+        child_pointers = []
+        for _ in range(children):
+            pointer += 1
+            child_pointers.append(pointer)
+            write_item(os.path.join(alias_dir, 'Cpd', str(parent)), pointer, fields, 'jp2', field_width, binary_size, rand)
+        if rand.random() < monograph_share:
+            structure = make_monograph_structure(child_pointers, monograph_depth, rand)
+        else:
+            structure = make_document_structure(child_pointers)
+        with open(os.path.join(alias_dir, 'Cpd', '{}_cpd.xml'.format(parent)), 'w', encoding='utf-8') as f:
+            f.write(structure)
+
+    rand.shuffle(records)
+    for num, start in enumerate(range(0, max(len(records), 1), page_size)):
+        page = {'pager': {'start': start + 1, 'maxrecs': page_size, 'total': len(records)},
+                'records': records[start:start + page_size]}
+        write_json(os.path.join(alias_dir, 'Elems_in_Collection_{}.json'.format(num)), page)
+    return alias_dir
+
+
+def mapping_field_names(alias):
+    with open(os.path.join('mappings_files', '{}.csv'.format(alias)), 'r', encoding='utf-8') as f:
+        return [name for name, template in csv.reader(f) if 'null' not in name and '%value%' in template]
+
+
+def make_fields(names):
+    fields, nicks = [], set()
+    for name in names:
+        nick = ''.join(i for i in name.lower() if i.isalnum())[:6] or 'field'
+        while nick in nicks:
+            nick = '{}{}'.format(nick[:5], len(nicks))
+        nicks.add(nick)
+        fields.append({'name': name, 'nick': nick, 'type': 'TEXT', 'size': 0, 'find': 'a{}'.format(len(fields)),
+                       'req': 0, 'search': 1, 'hide': 0, 'vocdb': '', 'vocab': 0, 'dc': 'BLANK', 'admin': 0, 'readonly': 0})
+    return fields
+
+
+def make_value(name, field_width, rand):
+    name = name.lower()
+    if 'date' in name:
+        return '{}-{:02d}-{:02d}'.format(rand.randint(1850, 2000), rand.randint(1, 12), rand.randint(1, 28))
+    if 'language' in name:
+        return 'eng'
+    if any(i in name for i in ('creator', 'contributor', 'photographer', 'author')):
+        return '; '.join(rand.sample(NAMES, rand.randint(1, 3)))
+    if any(i in name for i in ('subject', 'coverage', 'place', 'spatial')):
+        return '; '.join(rand.sample(WORDS, rand.randint(1, 6)))
+    if any(i in name for i in ('description', 'note', 'transcript', 'abstract')):
+        words, length = [], 0
+        while length < field_width:
+            words.append(rand.choice(WORDS))
+            length += len(words[-1]) + 1
+        return ' '.join(words).capitalize() + '.'
+    return ' '.join(rand.sample(WORDS, rand.randint(1, 4))).title()
+
+
+def write_item(folder, pointer, fields, filetype, field_width, binary_size, rand):
+    os.makedirs(folder, exist_ok=True)
+    item = dict()
+    for field in fields:
+        # cdm gives an empty dict for an empty field
+        item[field['nick']] = make_value(field['name'], field_width, rand) if rand.random() < 0.85 else {}
+    if fields:
+        item[fields[0]['nick']] = 'Item {} {}'.format(pointer, make_value('title', field_width, rand))
+    item.update({'dmaccess': '' if rand.random() < 0.97 else 'restricted',
+                 'dmimage': {},
+                 'dmcreated': '2015-06-01',
+                 'dmmodified': '2016-01-15',
+                 'dmrecord': str(pointer),
+                 'find': '{}.{}'.format(pointer, filetype), })
+    write_json(os.path.join(folder, '{}.json'.format(pointer)), item)
+    if binary_size and filetype != 'cpd':
+        with open(os.path.join(folder, '{}.{}'.format(pointer, filetype)), 'wb') as f:
+            f.write(os.urandom(binary_size))
+
+
+def make_page(pointer):
+    return ('<page><pagetitle>Page {0}</pagetitle><pagefile>{0}.jp2</pagefile>'
+            '<pageptr>{0}</pageptr></page>'.format(pointer))
+
+
+def make_document_structure(child_pointers):
+    pages = ''.join(make_page(i) for i in child_pointers)
+    return '<cpd><type>Document</type>{}</cpd>'.format(pages)
+
+
+def make_monograph_structure(child_pointers, depth, rand):
+    # nodes nest depth levels deep, and only the innermost nodes hold pages
+    def make_node(pointers, level, title):
+        if level == depth or len(pointers) < 2:
+            return '<node><nodetitle>{}</nodetitle>{}</node>'.format(title, ''.join(make_page(i) for i in pointers))
+        cut = rand.randint(1, len(pointers) - 1)
+        return '<node><nodetitle>{}</nodetitle>{}{}</node>'.format(title,
+                                                                   make_node(pointers[:cut], level + 1, '{} part 1'.format(title)),
+                                                                   make_node(pointers[cut:], level + 1, '{} part 2'.format(title)))
+    return '<cpd><type>Monograph</type>{}</cpd>'.format(make_node(child_pointers, 1, 'Volume 1'))
+
+
+def write_json(filepath, data):
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cdm_data_dir', help='where the {alias} folder is written')
+    parser.add_argument('--alias', default='p16313coll97', help='post_cdm_cleanup needs an alias it knows the institution of')
+    parser.add_argument('--like', default=None, help='take the fields from mappings_files/{LIKE}.csv')
+    parser.add_argument('--simples', type=int, default=1000)
+    parser.add_argument('--compounds', type=int, default=0)
+    parser.add_argument('--children', type=int, default=10, help='children per compound')
+    parser.add_argument('--monograph-share', type=float, default=0.5, help='share of compounds that are Monographs')
+    parser.add_argument('--monograph-depth', type=int, default=2, help='node levels in a Monograph structure')
+    parser.add_argument('--field-width', type=int, default=200, help='characters in description-like fields')
+    parser.add_argument('--page-size', type=int, default=1000, help='records per Elems_in_Collection file')
+    parser.add_argument('--binary-size', type=int, default=1024, help='bytes per placeholder binary, 0 for none')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    alias_dir = main(args.cdm_data_dir, alias=args.alias, like=args.like, simples=args.simples,
+                     compounds=args.compounds, children=args.children, monograph_share=args.monograph_share,
+                     monograph_depth=args.monograph_depth, field_width=args.field_width,
+                     page_size=args.page_size, binary_size=args.binary_size, seed=args.seed)
+    print(alias_dir)
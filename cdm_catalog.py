@@ -0,0 +1,235 @@
+#! /usr/bin/env python3
+
+import os
+import json
+import sqlite3
+import logging
+import argparse
+
+
+SCHEMA_VERSION = 4
+SCHEMA = """
+CREATE TABLE dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER);
+CREATE INDEX dirs_parent ON dirs (parent);
+CREATE TABLE files (path TEXT PRIMARY KEY, dir TEXT, kind TEXT, pointer TEXT, extension TEXT,
+                    size INTEGER, mtime_ns INTEGER);
+CREATE INDEX files_dir ON files (dir);
+CREATE INDEX files_pointer ON files (pointer);
+CREATE TABLE elems (path TEXT PRIMARY KEY, total INTEGER);
+CREATE TABLE records (elems_path TEXT, position INTEGER, pointer TEXT, filetype TEXT, PRIMARY KEY (elems_path, position));
+CREATE TABLE structures (path TEXT PRIMARY KEY, sha256 TEXT, type TEXT, monograph_titles TEXT, monograph_error TEXT);
+CREATE TABLE children (structure_path TEXT, position INTEGER, parent TEXT, child TEXT, PRIMARY KEY (structure_path, position));
+CREATE INDEX children_parent ON children (parent);
+CREATE TABLE restrictions (json_path TEXT PRIMARY KEY, pointer TEXT, dmaccess TEXT);
+"""
+BINARY_EXTENSIONS = ('.jp2', '.mp4', '.mp3', '.pdf')
+
+
+class CdmCatalog():
+    # A sqlite catalog of one Cached_Cdm_files/{alias} tree, kept in output/{alias}_catalog.sqlite: every file,
+    # the Elems_in_Collection records, each _cpd.xml's type, monograph titles and children in page order, and
+    # the dmaccess restriction convert_cdm_to_mods noted for each pointer json it built from.
+    # A refresh only lists the folders whose mtime changed since the last one, which is what a file being
+    # added, removed or renamed changes.  The few files at the top of the tree (Elems_in_Collection, Collection_Fields)
+    # are restatted every time; full_scan restats every file, to catch any file rewritten in place.
+    def __init__(self, alias_data_dir, full_scan=False):
+        self.alias_data_dir = alias_data_dir
+        alias = os.path.basename(os.path.normpath(alias_data_dir))
+        self.db_path = os.path.join('output', '{}_catalog.sqlite'.format(alias))
+        os.makedirs('output', exist_ok=True)
+        self.db = sqlite3.connect(self.db_path)
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.make_tables()
+        self.refresh(full_scan)
+
+    def make_tables(self):
+        for table, kind in self.db.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view')").fetchall():
+            self.db.execute('DROP {} IF EXISTS {}'.format(kind.upper(), table))
+        self.db.executescript(SCHEMA)
+        self.db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        self.db.commit()
+
+    def refresh(self, full_scan=False):
+        known_dirs = dict(self.db.execute('SELECT path, mtime_ns FROM dirs'))
+        seen_dirs = set()
+        listed, changed = 0, 0
+        pending = ['']
+        with self.db:
+            while pending:
+                rel_dir = pending.pop()
+                try:
+                    mtime_ns = os.stat(os.path.join(self.alias_data_dir, rel_dir)).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                seen_dirs.add(rel_dir)
+                if not full_scan and rel_dir and known_dirs.get(rel_dir) == mtime_ns:
+                    pending.extend(path for path, in self.db.execute('SELECT path FROM dirs WHERE parent = ?', (rel_dir, )))
+                    continue
+                listed += 1
+                changed += self.scan_dir(rel_dir, mtime_ns, pending)
+            for rel_dir in set(known_dirs) - seen_dirs:
+                for path, in self.db.execute('SELECT path FROM files WHERE dir = ?', (rel_dir, )).fetchall():
+                    self.remove_file(path)
+                    changed += 1
+                self.db.execute('DELETE FROM dirs WHERE path = ?', (rel_dir, ))
+        logging.info('catalog {}: {} folders listed, {} files changed'.format(self.db_path, listed, changed))
+
+    def scan_dir(self, rel_dir, mtime_ns, pending):
+        known_files = {path: (size, file_mtime_ns) for path, size, file_mtime_ns
+                       in self.db.execute('SELECT path, size, mtime_ns FROM files WHERE dir = ?', (rel_dir, ))}
+        changed = 0
+        found = set()
+        for entry in os.scandir(os.path.join(self.alias_data_dir, rel_dir)):
+            rel_path = os.path.join(rel_dir, entry.name)
+            if entry.is_dir():
+                pending.append(rel_path)
+                continue
+            kind, pointer, extension = classify(entry.name)
+            if kind is None:
+                continue
+            found.add(rel_path)
+            stat = entry.stat()
+            if known_files.get(rel_path) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            self.update_file(rel_path, rel_dir, kind, pointer, extension, stat)
+            changed += 1
+        for rel_path in set(known_files) - found:
+            self.remove_file(rel_path)
+            changed += 1
+        self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                        (rel_dir, os.path.dirname(rel_dir) if rel_dir else None, mtime_ns))
+        return changed
+
+    def update_file(self, rel_path, rel_dir, kind, pointer, extension, stat):
+        self.remove_file(rel_path)
+        filepath = os.path.join(self.alias_data_dir, rel_path)
+        if kind == 'elems':
+            total, records = read_elems_in_collection(filepath)
+            self.db.execute('INSERT INTO elems VALUES (?, ?)', (rel_path, total))
+            self.db.executemany('INSERT INTO records VALUES (?, ?, ?, ?)',
+                                [(rel_path, position, record_pointer, filetype)
+                                 for position, (record_pointer, filetype) in enumerate(records)])
+        elif kind == 'structure':
+            # the one parse of a structure file, until it changes
+            entry = read_structure(filepath)
+            self.db.execute('INSERT INTO structures VALUES (?, ?, ?, ?, ?)',
+                            (rel_path, entry['sha256'], entry['type'], json.dumps(entry['monograph_titles']), entry['monograph_error']))
+            self.db.executemany('INSERT INTO children VALUES (?, ?, ?, ?)',
+                                [(rel_path, position, pointer, child) for position, child in enumerate(entry['children'])])
+        self.db.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (rel_path, rel_dir, kind, pointer, extension, stat.st_size, stat.st_mtime_ns))
+
+    def remove_file(self, rel_path):
+        self.db.execute('DELETE FROM files WHERE path = ?', (rel_path, ))
+        self.db.execute('DELETE FROM elems WHERE path = ?', (rel_path, ))
+        self.db.execute('DELETE FROM records WHERE elems_path = ?', (rel_path, ))
+        self.db.execute('DELETE FROM structures WHERE path = ?', (rel_path, ))
+        self.db.execute('DELETE FROM children WHERE structure_path = ?', (rel_path, ))
+        # noted again when the changed json is next converted
+        self.db.execute('DELETE FROM restrictions WHERE json_path = ?', (rel_path, ))
+
+    def files(self):
+        # (kind, pointer, absolute path) for every cataloged file, in path order
+        return [(kind, pointer, os.path.join(self.alias_data_dir, path))
+                for kind, pointer, path in self.db.execute('SELECT kind, pointer, path FROM files ORDER BY path')]
+
+    def relative(self, filepaths):
+        return [os.path.relpath(filepath, self.alias_data_dir) for filepath in filepaths]
+
+    def records(self, elems_filepaths):
+        # (pointer, filetype) for every record in these Elems_in_Collection files, in file order
+        records = []
+        for elems_path in sorted(self.relative(elems_filepaths)):
+            records.extend(self.db.execute('SELECT pointer, filetype FROM records WHERE elems_path = ? ORDER BY position',
+                                           (elems_path, )))
+        return records
+
+    def elems_totals(self, elems_filepaths):
+        return [total for elems_path in self.relative(elems_filepaths)
+                for total, in self.db.execute('SELECT total FROM elems WHERE path = ?', (elems_path, ))]
+
+    def structure(self, structure_filepath):
+        # StructureCache's entry for a cataloged _cpd.xml, or None
+        rel_path = os.path.relpath(structure_filepath, self.alias_data_dir)
+        row = self.db.execute('SELECT sha256, type, monograph_titles, monograph_error FROM structures WHERE path = ?',
+                              (rel_path, )).fetchone()
+        if row is None:
+            return None
+        sha256, structure_type, monograph_titles, monograph_error = row
+        return {'sha256': sha256,
+                'type': structure_type,
+                'children': [child for child, in self.db.execute('SELECT child FROM children WHERE structure_path = ? ORDER BY position',
+                                                                 (rel_path, ))],
+                'monograph_titles': json.loads(monograph_titles),
+                'monograph_error': monograph_error, }
+
+    def children(self, pointer):
+        # a compound's child pointers in page order, from the first of its _cpd.xml files; None if it has none
+        row = self.db.execute("SELECT path FROM files WHERE kind = 'structure' AND pointer = ? ORDER BY path LIMIT 1",
+                              (pointer, )).fetchone()
+        if row is None:
+            return None
+        return [child for child, in self.db.execute('SELECT child FROM children WHERE structure_path = ? ORDER BY position', row)]
+
+    def note_restrictions(self, restrictions):
+        # (pointer json path, pointer, dmaccess) as the conversion read them; '' for an unrestricted pointer
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO restrictions VALUES (?, ?, ?)',
+                                [(os.path.relpath(json_path, self.alias_data_dir), pointer, dmaccess or '')
+                                 for json_path, pointer, dmaccess in restrictions])
+
+    def unnoted_jsons(self, json_paths):
+        # the pointer jsons whose restriction no conversion has noted since they last changed
+        noted = {json_path for json_path, in self.db.execute('SELECT json_path FROM restrictions')}
+        return {json_path for json_path in json_paths if os.path.relpath(json_path, self.alias_data_dir) not in noted}
+
+    def restrictions(self):
+        # {pointer: dmaccess} for every restricted pointer
+        return dict(self.db.execute("SELECT pointer, dmaccess FROM restrictions WHERE dmaccess != '' ORDER BY json_path"))
+
+    def close(self):
+        self.db.close()
+
+
+def classify(filename):
+    # the same sorting CdmPathIndex always did: (kind, pointer, extension), or Nones for files nobody reads
+    pointer, extension = os.path.splitext(filename)
+    if "Elems_in_Collection" in filename and ".json" in filename:
+        return 'elems', None, extension
+    if extension == '.json':
+        return 'json', pointer, extension
+    if "_cpd.xml" in filename:
+        return 'structure', filename.replace('_cpd.xml', ''), extension
+    if extension.lower() in BINARY_EXTENSIONS:
+        return 'binary', pointer, extension
+    return None, None, None
+
+
+def read_elems_in_collection(filepath):
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            parsed_json = json.loads(f.read())
+    except ValueError:
+        logging.warning('{} is improperly formed json.  Conversion halted!'.format(filepath))
+        quit()
+    records = [(str(i['pointer'] or i['dmrecord']), i['filetype']) for i in parsed_json['records']]
+    return parsed_json['pager']['total'], records
+
+
+def read_structure(filepath):
+    # imported here, since utilities imports this module
+    from utilities import StructureCache
+    return StructureCache.parse(filepath)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s %(message)s')
+    parser = argparse.ArgumentParser(usage='python cdm_catalog.py $aliasname $path/to/Cached_Cdm_files [--full-scan]')
+    parser.add_argument('alias')
+    parser.add_argument('cdm_data_dir')
+    parser.add_argument('--full-scan', action='store_true', help='restat every cached file, to catch files edited in place in folders that look unchanged')
+    args = parser.parse_args()
+    catalog = CdmCatalog(os.path.join(args.cdm_data_dir, args.alias), full_scan=args.full_scan)
+    for kind, count in catalog.db.execute('SELECT kind, COUNT(*) FROM files GROUP BY kind ORDER BY kind'):
+        logging.info('{}: {}'.format(kind, count))
+    catalog.close()
@@ -0,0 +1,71 @@
+#! /usr/bin/env python3
+
+import os
+import json
+import hashlib
+import logging
+
+
+class ConversionManifest():
+    # Per-alias record of what every pointer's mods was built from, so a rerun can skip unchanged pointers.
+    def __init__(self, alias):
+        self.path = os.path.join('output', '{}_manifest.json'.format(alias))
+        self.previous = self.load()
+        self.inputs = dict()
+        self.pointers = dict()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return {'inputs': {}, 'pointers': {}}
+
+    def add_input(self, name, filepath=None, value=None):
+        if filepath is not None:
+            value = hash_file(filepath)
+        self.inputs[name] = value
+
+    def inputs_changed(self):
+        return self.inputs != self.previous.get('inputs')
+
+    def add_pointer(self, pointer, output_file, source_hashes, extras=()):
+        # source_hashes are the sha256 of each source file, from hash_file or from bytes already read
+        digest = hashlib.sha256()
+        for source_hash in source_hashes:
+            digest.update(source_hash.encode('utf-8'))
+        for extra in extras:
+            digest.update(b'\0')
+            digest.update(str(extra).encode('utf-8'))
+        self.pointers[pointer] = {'hash': digest.hexdigest(), 'output': output_file}
+
+    def is_current(self, pointer):
+        previous = self.previous.get('pointers', dict()).get(pointer)
+        return (previous is not None and
+                previous == self.pointers.get(pointer) and
+                os.path.isfile(previous['output']))
+
+    def remove_stale_outputs(self):
+        for pointer, previous in self.previous.get('pointers', dict()).items():
+            if pointer in self.pointers and self.pointers[pointer]['output'] == previous['output']:
+                continue
+            if os.path.isfile(previous['output']):
+                os.remove(previous['output'])
+                logging.info('removed {}, pointer {} is no longer in the source data'.format(previous['output'], pointer))
+                try:
+                    os.rmdir(os.path.dirname(previous['output']))
+                except OSError:
+                    pass
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'inputs': self.inputs, 'pointers': self.pointers}, indent=1, sort_keys=True))
+
+
+def hash_file(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -1,62 +1,112 @@
 #! /usr/bin/python3
 
 import os
-import sys
+import io
+import hashlib
 from shutil import copyfile
-import subprocess
+from shutil import rmtree
+import time
+import heapq
 import datetime
-import re
 import csv
 import json
-from copy import deepcopy
 import logging
+import argparse
+import multiprocessing
 
 from lxml import etree as ET
 
 from post_cdm_cleanup import IsCountsCorrect
+from conversion_manifest import ConversionManifest
+from conversion_manifest import hash_file
+from utilities import CdmPathIndex
 from utilities import MonographTitleCombiner
+from utilities import StructureCache
+from utilities import compile_mappings
+from utilities import merge_same_fields
+from utilities import split_fields
 from utilities import fix_permissions
+from utilities import alias_output_paths
+from utilities import items_sidecar_path
+from utilities import write_items_sidecar
+from utilities import read_items_sidecar
 from utilities import setup_logging
+from saxon_worker import run_saxon
+from mods_audit import audit_mods
+from run_report import RunReport
 
 
-MODS_DEF = ET.parse('schema/mods-3-6.xsd')
-MODS_SCHEMA = ET.XMLSchema(MODS_DEF)
-
-
-def main(alias, cdm_data_dir):
-    remove_previous_mods(alias)
+def main(alias, cdm_data_dir, workers=1, saxon_debug=False, incremental=False, reproducible=False, run_fix_permissions=True,
+         prometheus_dir=None, profile_stage=None, slowest=10, full_scan=False):
+    report = RunReport(alias, 'convert', profile_stage)
     alias_data_dir = os.path.realpath(os.path.join(cdm_data_dir, alias))
+    manifest = ConversionManifest(alias)
+    manifest.add_input('mappings', filepath=os.path.join('mappings_files', '{}.csv'.format(alias)))
+    manifest.add_input('collection_fields', filepath=os.path.join(alias_data_dir, 'Collection_Fields.json'))
+    alias_xslts = read_alias_xslt_file(alias)
+    manifest.add_input('alias_xslts', value=alias_xslts)
+    for xslt in alias_xslts:
+        manifest.add_input('xsl/{}.xsl'.format(xslt), filepath=os.path.join('xsl', '{}.xsl'.format(xslt)))
+    for module in ('convert_cdm_to_mods.py', 'utilities.py'):
+        manifest.add_input(module, filepath=os.path.join(os.path.dirname(os.path.abspath(__file__)), module))
+    manifest.add_input('reproducible', value=reproducible)
+    if incremental and not manifest.previous.get('inputs'):
+        logging.info('no manifest from a previous run; rebuilding every pointer')
+        incremental = False
+    elif incremental and manifest.inputs_changed():
+        logging.info('mappings, xslts, or collection fields changed since the last run; rebuilding every pointer')
+        incremental = False
+    elif incremental and not os.path.isfile(items_sidecar_path(alias)):
+        logging.info('no item sidecar from a previous run; rebuilding every pointer')
+        incremental = False
+    with report.stage('remove previous mods'):
+        if incremental:
+            remove_intermediate_mods(alias)
+        else:
+            remove_previous_mods(alias)
+
     nicks_to_names_dict = make_nicks_to_names(alias_data_dir)
-    mappings_dict = parse_mappings_file(alias)
-    cdm_data_filestructure = [(root, dirs, files) for root, dirs, files in os.walk(alias_data_dir)]
-    simple_pointers, cpd_parent_pointers = parse_root_cdm_pointers(cdm_data_filestructure)
-    parents_children = parse_parents_children(alias_data_dir, cpd_parent_pointers)
-    expanded_monograph_title_dict = MonographTitleCombiner(alias_data_dir).monograph_pointer_newtitle
+    try:
+        mapping_templates = compile_mappings(parse_mappings_file(alias))
+    except ValueError as e:
+        logging.fatal('{} \n Program cancelled'.format(e))
+        quit()
+    with report.stage('pointer discovery') as stage:
+        path_index = CdmPathIndex(alias_data_dir, full_scan=full_scan)
+        report.wrote(path_index.catalog.db_path)
+        simple_pointers, cpd_parent_pointers = parse_root_cdm_pointers(path_index)
+        stage['items'] = len(simple_pointers) + len(cpd_parent_pointers)
+    structure_cache = StructureCache(path_index)
+    with report.stage('parents and children') as stage:
+        parents_children = parse_parents_children(path_index.catalog, cpd_parent_pointers)
+        stage['items'] = sum(len(children) for children in parents_children.values())
+    with report.stage('monograph titles') as stage:
+        expanded_monograph_title_dict = MonographTitleCombiner(alias_data_dir, path_index, structure_cache).monograph_pointer_newtitle
+        stage['items'] = len(expanded_monograph_title_dict)
+
+    shared_ingredients = (alias, nicks_to_names_dict, mapping_templates, expanded_monograph_title_dict, reproducible)
 
     # root level simples
+    simple_jobs = []
+    items = []
     for pointer in sorted(simple_pointers):
         output_path = os.path.join('output', '{}_simples'.format(alias), 'original_format')
         output_file = os.path.join(output_path, '{}.xml'.format(pointer))
-        target_file = '{}.json'.format(pointer)
-        try:
-            path_to_pointer = [os.path.join(root, target_file)
-                               for root, dirs, files in cdm_data_filestructure
-                               if target_file in files][0]
-        except IndexError:
+        path_to_pointer = path_index.json_path(pointer)
+        if not path_to_pointer:
             logging.warning('Conversion halted! Pointer {} is missing in your source data'.format(pointer))
             quit()
-        ingredients = (pointer, path_to_pointer, output_path, output_file, nicks_to_names_dict, mappings_dict, expanded_monograph_title_dict)
-        make_a_single_mods(ingredients)
-    logging.info('finished preliminary mods: simples')
+        simple_jobs.append((pointer, path_to_pointer, output_path, output_file))
+        items.append(new_item(pointer, 'simple', None, output_file, path_index))
 
     # root level compounds
+    compound_jobs = []
     for pointer, _ in sorted(parents_children.items()):
         output_path = os.path.join('output', '{}_compounds'.format(alias), 'original_format', pointer)
         output_file = os.path.join(output_path, 'MODS.xml')
         path_to_pointer = os.path.join(alias_data_dir, 'Cpd', '{}.json'.format(pointer))
-        ingredients = (pointer, path_to_pointer, output_path, output_file, nicks_to_names_dict, mappings_dict, expanded_monograph_title_dict)
-        make_a_single_mods(ingredients)
-        copyfile(os.path.join(alias_data_dir, 'Cpd', '{}_cpd.xml'.format(pointer)), os.path.join(output_path, 'structure.cpd'))
+        compound_jobs.append((pointer, path_to_pointer, output_path, output_file))
+        items.append(new_item(pointer, 'compound', None, output_file, path_index))
 
     # child level simples
     for parent, children_pointers in sorted(parents_children.items()):
@@ -64,19 +114,62 @@ def main(alias, cdm_data_dir):
             output_path = os.path.join('output', '{}_compounds'.format(alias), 'original_format', parent, pointer)
             output_file = os.path.join(output_path, 'MODS.xml')
             path_to_pointer = os.path.join(alias_data_dir, 'Cpd', parent, '{}.json'.format(pointer))
-            ingredients = (pointer,
-                           path_to_pointer,
-                           output_path,
-                           output_file,
-                           nicks_to_names_dict,
-                           mappings_dict,
-                           expanded_monograph_title_dict)
-            make_a_single_mods(ingredients)
-    logging.info('finished preliminary mods: compounds')
+            compound_jobs.append((pointer, path_to_pointer, output_path, output_file))
+            items.append(new_item(pointer, 'child', parent, output_file, path_index))
+
+    unchanged_items = []
+    if incremental:
+        # hashed from disk: whether a pointer is rebuilt can't wait for a worker to read it
+        add_manifest_pointers(manifest, simple_jobs + compound_jobs, structure_cache, expanded_monograph_title_dict)
+        manifest.remove_stale_outputs()
+        # a pointer whose restriction isn't in the catalog, e.g. after the catalog was rebuilt, is converted again to note it
+        unnoted = path_index.catalog.unnoted_jsons([job[1] for job in simple_jobs + compound_jobs])
+        current = {job[0] for job in simple_jobs + compound_jobs if manifest.is_current(job[0]) and job[1] not in unnoted}
+        unchanged_items = [item for item in items if item['pointer'] in current]
+        simple_jobs = [job for job in simple_jobs if job[0] not in current]
+        compound_jobs = [job for job in compound_jobs if job[0] not in current]
+        logging.info('incremental run: rebuilding {} simple and {} compound pointers'.format(len(simple_jobs), len(compound_jobs)))
+
+    pointer_seconds = []
+    pointer_facts = dict()
+    build_workers = workers
+    if report.is_profiled('mods build simples') or report.is_profiled('mods build compounds'):
+        logging.info('profiling the mods build in this process, not with {} workers'.format(workers))
+        build_workers = 1
+    with report.stage('mods build simples', items=len(simple_jobs)) as stage:
+        stage['bytes'] = make_all_mods(simple_jobs, shared_ingredients, build_workers, pointer_seconds, pointer_facts)
+    logging.info('finished preliminary mods: simples')
 
-    saxon_n_cleanup_mods(alias)
-    IsCountsCorrect(alias, cdm_data_dir)
-    fix_permissions()
+    with report.stage('mods build compounds', items=len(compound_jobs)) as stage:
+        stage['bytes'] = make_all_mods(compound_jobs, shared_ingredients, build_workers, pointer_seconds, pointer_facts)
+        for pointer, _ in sorted(parents_children.items()):
+            output_path = os.path.join('output', '{}_compounds'.format(alias), 'final_format', pointer)
+            os.makedirs(output_path, exist_ok=True)
+            copyfile(path_index.structure_file(pointer), os.path.join(output_path, 'structure.cpd'))
+    logging.info('finished preliminary mods: compounds')
+    if not incremental:
+        add_manifest_pointers(manifest, simple_jobs + compound_jobs, structure_cache, expanded_monograph_title_dict, pointer_facts)
+    path_index.catalog.note_restrictions((job[1], job[0], pointer_facts[job[0]]['dmaccess'])
+                                         for job in simple_jobs + compound_jobs if job[0] in pointer_facts)
+    # pointers an incremental run didn't rebuild keep what the last run noted
+    previous_items = {item['pointer']: item for item in read_items_sidecar(alias)} if incremental else dict()
+    for item in items:
+        facts = pointer_facts.get(item['pointer']) or previous_items.get(item['pointer'], dict())
+        item['filetype'] = facts.get('filetype')
+    report.wrote(write_items_sidecar(alias, items))
+    report.slowest_pointers = describe_slowest_pointers(pointer_seconds, nicks_to_names_dict, slowest)
+
+    saxon_n_cleanup_mods(alias, saxon_debug, audit_workers=workers if workers > 1 else None, report=report,
+                         unchanged_docs=[(audit_name(item), item['mods']) for item in unchanged_items])
+    with report.stage('IsCountsCorrect'):
+        IsCountsCorrect(alias, cdm_data_dir, path_index)
+    manifest.save()
+    report.wrote(manifest.path)
+    for output_path in alias_output_paths(alias):
+        report.wrote(output_path)
+    report.write(prometheus_dir)
+    if run_fix_permissions:
+        fix_permissions(report.written)
     logging.info('completed')
     logging.info('Your output files are in:  output/{}_simple/final_format/ and output/{}_compounds/final_format/'.format(alias, alias))
 
@@ -108,75 +201,210 @@ def parse_mappings_file(alias):
         return {i: j for i, j in csv_reader}
 
 
-def parse_parents_children(cdm_data_dir, cpd_parent_pointers):
+def parse_parents_children(catalog, cpd_parent_pointers):
     parents_children = dict()
     for cpd_parent in cpd_parent_pointers:
-        cpd_parent_filepath = os.path.join(cdm_data_dir, 'Cpd', '{}_cpd.xml'.format(cpd_parent))
-        cpd_parent_etree = ET.parse(cpd_parent_filepath)
-        children_pointers = [i.text for i in cpd_parent_etree.findall('.//pageptr')]
+        children_pointers = catalog.children(cpd_parent)
+        if children_pointers is None:
+            logging.warning('Conversion halted! Compound {} has no {}_cpd.xml in your source data'.format(cpd_parent, cpd_parent))
+            quit()
         parents_children[cpd_parent] = children_pointers
     return parents_children
 
 
-def parse_root_cdm_pointers(cdm_data_filestructure):
-    Elems_ins = [os.path.join(root, file)
-                 for root, dirs, files in cdm_data_filestructure
-                 for file in files
-                 if ("Elems_in_Collection" in file and ".json" in file)]
+def parse_root_cdm_pointers(path_index):
     simple_pointers, cpd_parent_pointers = [], []
-    duplicates = []
-    for filename in Elems_ins:
-        json_text = get_cdm_pointer_json(filename)
-        nicks_text = parse_json(filename, json_text)
-        for i in nicks_text['records']:
-            pointer = str(i['pointer'] or i['dmrecord'])
-            if i['filetype'] == 'cpd':
-                cpd_parent_pointers.append(pointer)
-            else:
-                if pointer in simple_pointers:
-                    duplicates.append(pointer)
-                simple_pointers.append(pointer)
+    for pointer, filetype in path_index.catalog.records(path_index.elems_in_collection):
+        if filetype == 'cpd':
+            cpd_parent_pointers.append(pointer)
+        else:
+            simple_pointers.append(pointer)
     return simple_pointers, cpd_parent_pointers
 
 
 def remove_previous_mods(alias):
+    # only this alias's own folders; "alias in root" also matched every alias that starts with this one
+    alias_dirs = [os.path.join('output', '{}_{}'.format(alias, kind)) for kind in ('simples', 'compounds')]
     xml_files = ['{}/{}'.format(root, file)
-                 for root, dirs, files in os.walk('output')
+                 for alias_dir in alias_dirs
+                 for root, dirs, files in os.walk(alias_dir)
                  for file in files
-                 if alias in root and ".xml" in file]
+                 if ".xml" in file]
     for file in xml_files:
         os.remove(file)
 
 
-def make_a_single_mods(ingredients):
-    (pointer, path_to_pointer, output_path, output_file, nicks_to_names_dict, mappings_dict, expanded_monograph_title_dict) = ingredients
+def remove_intermediate_mods(alias):
+    # keep final_format, everything upstream of it is rebuilt from the pointers that changed
+    for kind in ('simples', 'compounds'):
+        output_dir = os.path.join('output', '{}_{}'.format(alias, kind))
+        if not os.path.isdir(output_dir):
+            continue
+        for entry in os.listdir(output_dir):
+            if entry == 'final_format':
+                continue
+            entry_path = os.path.join(output_dir, entry)
+            if os.path.isdir(entry_path):
+                rmtree(entry_path)
+            else:
+                os.remove(entry_path)
+
+
+def make_all_mods(jobs, shared_ingredients, workers=1, pointer_seconds=None, pointer_facts=None):
+    # jobs are (pointer, path_to_pointer, output_path, output_file);
+    # files are written here, in job order, whichever process built them.  Returns the bytes written,
+    # adds (seconds, pointer, path_to_pointer) for each job to pointer_seconds, and each pointer's
+    # dmaccess and filetype to pointer_facts.
+    failures = []
+    written = 0
+    if workers > 1 and len(jobs) > 1:
+        chunksize = max(1, min(64, len(jobs) // (workers * 8)))
+        with multiprocessing.Pool(workers, initializer=init_mods_worker, initargs=shared_ingredients) as pool:
+            for job, (pointer, mods_bytes, facts, error, seconds) in zip(jobs, pool.imap(run_mods_job, jobs, chunksize)):
+                written += write_mods_result(job, mods_bytes, error, failures)
+                if pointer_seconds is not None:
+                    pointer_seconds.append((seconds, pointer, job[1]))
+                if pointer_facts is not None and facts:
+                    pointer_facts[pointer] = facts
+    else:
+        init_mods_worker(*shared_ingredients)
+        for job in jobs:
+            pointer, mods_bytes, facts, error, seconds = run_mods_job(job)
+            written += write_mods_result(job, mods_bytes, error, failures)
+            if pointer_seconds is not None:
+                pointer_seconds.append((seconds, pointer, job[1]))
+            if pointer_facts is not None and facts:
+                pointer_facts[pointer] = facts
+    if failures:
+        for pointer, error in failures:
+            logging.warning('Pointer {} failed to convert: {}'.format(pointer, error))
+        logging.warning('Conversion halted! {} pointers failed to convert'.format(len(failures)))
+        quit()
+    return written
+
+
+def add_manifest_pointers(manifest, jobs, structure_cache, expanded_monograph_title_dict, pointer_facts=None):
+    # a pointer's json is hashed from the bytes its worker read, when there was a worker, else from disk
+    pointer_facts = pointer_facts or dict()
+    for pointer, path_to_pointer, output_path, output_file in jobs:
+        facts = pointer_facts.get(pointer)
+        source_hashes = [facts['sha256'] if facts else hash_file(path_to_pointer)]
+        structure_file = structure_cache.path_index.structure_file(pointer)
+        if structure_file:
+            source_hashes.append(structure_cache.sha256(structure_file))
+        manifest.add_pointer(pointer,
+                             output_file.replace('original_format', 'final_format'),
+                             source_hashes,
+                             [expanded_monograph_title_dict.get(pointer, '')])
+
+
+def write_mods_result(job, mods_bytes, error, failures):
+    pointer, path_to_pointer, output_path, output_file = job
+    if error:
+        failures.append((pointer, error))
+        return 0
     os.makedirs(output_path, exist_ok=True)
-    pointer_json = get_cdm_pointer_json(path_to_pointer)
+    with open(output_file, 'wb') as f:
+        f.write(mods_bytes)
+    return len(mods_bytes)
+
+
+mods_worker_ingredients = dict()
+
+
+def init_mods_worker(alias, nicks_to_names_dict, mapping_templates, expanded_monograph_title_dict, reproducible=False):
+    mods_worker_ingredients['shared'] = (alias, nicks_to_names_dict, mapping_templates, expanded_monograph_title_dict, reproducible)
+
+
+def run_mods_job(job):
+    pointer, path_to_pointer, output_path, output_file = job
+    ingredients = (pointer, path_to_pointer) + mods_worker_ingredients['shared']
+    start = time.time()
+    try:
+        mods_bytes, facts = make_a_single_mods(ingredients)
+        return pointer, mods_bytes, facts, None, time.time() - start
+    except Exception as e:
+        return pointer, None, None, str(e) or type(e).__name__, time.time() - start
+
+
+def audit_name(item):
+    # the name saxon_n_cleanup_mods audits a pointer's final mods under
+    return '{}_{}'.format(item['parent'], item['pointer']) if item['parent'] else item['pointer']
+
+
+def new_item(pointer, kind, parent, output_file, path_index):
+    binaries = path_index.binaries.get(pointer)
+    return {'pointer': pointer,
+            'kind': kind,
+            'parent': parent,
+            'mods': output_file.replace('original_format', 'final_format'),
+            'binary': os.path.join(*binaries[0]) if binaries else None, }
+
+
+def describe_item(nicks_texts):
+    # what the cleanup reports need from the json; cdm gives an empty dict for an empty field
+    find = nicks_texts.get('find')
+    return {'dmaccess': str(nicks_texts['dmaccess']) if nicks_texts.get('dmaccess') else None,
+            'filetype': os.path.splitext(find)[1].lstrip('.').lower() if isinstance(find, str) and find else None, }
+
+
+def describe_slowest_pointers(pointer_seconds, nicks_to_names_dict, slowest=10):
+    # the slowest builds, with their biggest fields: usually a huge transcript or hundreds of subjects
+    described = []
+    for seconds, pointer, path_to_pointer in heapq.nlargest(slowest, pointer_seconds):
+        try:
+            pointer_json = json.loads(get_cdm_pointer_json(path_to_pointer))
+        except (OSError, ValueError):
+            pointer_json = dict()
+        fields = [{'field': nicks_to_names_dict.get(nick, nick),
+                   'chars': len(text),
+                   'values': len([i for i in text.split(';') if i.strip()]), }
+                  for nick, text in pointer_json.items()
+                  if isinstance(text, str) and text]
+        fields.sort(key=lambda field: field['chars'], reverse=True)
+        described.append({'pointer': pointer,
+                          'seconds': round(seconds, 4),
+                          'json_bytes': os.path.getsize(path_to_pointer) if os.path.isfile(path_to_pointer) else None,
+                          'largest_fields': fields[:5], })
+    if described:
+        logging.info('slowest pointers: {}'.format(', '.join('{} ({:.3f}s)'.format(i['pointer'], i['seconds']) for i in described)))
+    return described
+
+
+def make_a_single_mods(ingredients):
+    (pointer, path_to_pointer, alias, nicks_to_names_dict, mapping_templates, expanded_monograph_title_dict, reproducible) = ingredients
+    pointer_json, json_sha256 = read_cdm_pointer_json(path_to_pointer)
     nicks_texts = parse_json(pointer, pointer_json)
     propers_texts = convert_nicks_to_propers(nicks_to_names_dict, nicks_texts)
-    mods = build_xml(path_to_pointer, pointer, pointer_json, propers_texts, alias, mappings_dict, expanded_monograph_title_dict)
+    if reproducible:
+        # the cached json's mtime, so rebuilding unchanged source gives byte-identical mods
+        timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(path_to_pointer))
+    else:
+        timestamp = datetime.datetime.now()
+    mods = build_xml(path_to_pointer, pointer, pointer_json, propers_texts, alias, mapping_templates, expanded_monograph_title_dict, timestamp)
     merge_same_fields(mods)
-    careful_tag_split(mods, 'name', 'namePart')
-    for sub_subject in ('topic', 'geographic', 'temporal', 'occupation'):
-        careful_tag_split(mods, 'subject', sub_subject)
-    for sub_subject in ("continent", "country", "province", "region", "state", "territory", "county", "city", "citySection", "island", "area"):
-        careful_tag_split(mods, 'hierarchicalGeographic', sub_subject)
+    split_fields(mods)
     delete_empty_fields(mods)
     reorder_title(mods)
     reorder_location(mods)
 
-    mods_bytes = ET.tostring(mods, xml_declaration=True, encoding="utf-8", pretty_print=True)
-    mods_string = mods_bytes.decode('utf-8')
-    with open(output_file, 'w', encoding="utf-8") as f:
-        f.write(mods_string)
+    facts = describe_item(nicks_texts)
+    facts['sha256'] = json_sha256
+    return ET.tostring(mods, xml_declaration=True, encoding="utf-8", pretty_print=True), facts
+
+
+def read_cdm_pointer_json(filepath):
+    # the text as get_cdm_pointer_json reads it, and the sha256 of its bytes for the conversion manifest
+    with open(filepath, 'rb') as f:
+        json_bytes = f.read()
+    return io.StringIO(json_bytes.decode('utf-8'), newline=None).read(), hashlib.sha256(json_bytes).hexdigest()
 
 
 def parse_json(filename, json_text):
     try:
         parsed_alias_json = json.loads(json_text)
     except json.decoder.JSONDecodeError:
-        logging.warning('{}.json is improperly formed json.  Conversion halted!'.format(filename))
-        quit()
+        raise ValueError('{}.json is improperly formed json.  Conversion halted!'.format(filename))
     return {nick: text for nick, text in parsed_alias_json.items()}
 
 
@@ -188,31 +416,24 @@ def convert_nicks_to_propers(nicks_to_names_dict, nicks_texts):
     return propers_texts
 
 
-def build_xml(path_to_pointer, pointer, pointer_json, propers_texts, alias, mappings_dict, expanded_monograph_title_dict):
+def build_xml(path_to_pointer, pointer, pointer_json, propers_texts, alias, mapping_templates, expanded_monograph_title_dict, timestamp):
     NSMAP = {None: "http://www.loc.gov/mods/v3",
              'mods': "http://www.loc.gov/mods/v3",
              'xsi': "http://www.w3.org/2001/XMLSchema-instance",
              'xlink': "http://www.w3.org/1999/xlink", }
     root_element = ET.Element("mods", nsmap=NSMAP)
 
-    for k, v in mappings_dict.items():
+    for k, template in mapping_templates.items():
         if k in propers_texts and propers_texts[k]:
             replacement = propers_texts[k]
             # overwrite with the expanded title if the pointer has one, otherwise keep normal title
             if k == 'Title':
                 replacement = expanded_monograph_title_dict.get(pointer, replacement)
-            for a, b in [('&', '&amp;'),
-                         ('"', '&quot;'),
-                         ('<', '&lt;'),
-                         ('>', '&gt;')]:
-                replacement = replacement.replace(a, b)
-            v = v.replace("%value%", replacement)
-            new_element = ET.fromstring(v)
-            root_element.append(new_element)
+            root_element.append(template.render(replacement))
         elif 'null' in k:
-            new_element = ET.fromstring(v)
-            if 'CONTENTdmData' in v:
-                make_contentDM_elem(new_element[0], pointer, pointer_json, alias)
+            new_element = template.render()
+            if 'CONTENTdmData' in template.source:
+                make_contentDM_elem(new_element[0], pointer, pointer_json, alias, timestamp)
             root_element.append(new_element)
 
     id_elem = ET.Element("identifier", attrib={'type': 'uri', 'invalid': 'yes', 'displayLabel': "Migrated From"})
@@ -221,7 +442,7 @@ def build_xml(path_to_pointer, pointer, pointer_json, propers_texts, alias, mapp
     return root_element
 
 
-def make_contentDM_elem(cdm_elem, pointer, pointer_json, alias):
+def make_contentDM_elem(cdm_elem, pointer, pointer_json, alias, timestamp):
     alias_elem = ET.Element('alias')
     alias_elem.text = alias
     cdm_elem.append(alias_elem)
@@ -231,44 +452,11 @@ def make_contentDM_elem(cdm_elem, pointer, pointer_json, alias):
     dmGetItemInfo_elem = ET.Element('dmGetItemInfo', attrib={
         'mimetype': "application/json",
         'source': "https://server16313.contentdm.oclc.org/dmwebservices/index.php?q=dmGetItemInfo/{}/{}/json".format(alias, pointer),
-        'timestamp': '{0:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.now()), })
+        'timestamp': '{0:%Y-%m-%d %H:%M:%S}'.format(timestamp), })
     dmGetItemInfo_elem.text = pointer_json
     cdm_elem.append(dmGetItemInfo_elem)
 
 
-def merge_same_fields(orig_etree):
-    for elem in orig_etree:
-        for following_elem in elem.itersiblings():
-            if elem.tag == following_elem.tag and elem.attrib == following_elem.attrib:
-                for child in following_elem.iterchildren():
-                    elem.insert(-1, child)
-    return orig_etree
-
-
-def careful_tag_split(etree, parent_tag_name, child_tag_name):
-    # we split the child_tag text into pieces
-    # and create a duplicate parent_tag object for each split child_tag text
-    for name_elem in etree.findall('.//{}'.format(parent_tag_name)):
-        remove_orig_parent = False
-        for child in name_elem.getchildren():
-            if child.tag == child_tag_name:
-                remove_orig_parent = True
-                for split in child.text.split(';'):
-                    split = split.strip()
-                    if not len(split):
-                        continue
-                    new_child_elem = deepcopy(child)
-                    new_child_elem.text = split
-                    copied_name_elem = deepcopy(name_elem)
-                    for i in copied_name_elem:
-                        if i.tag == child_tag_name:
-                            copied_name_elem.remove(i)
-                    copied_name_elem.insert(0, new_child_elem)
-                    name_elem.getparent().append(copied_name_elem)
-        if remove_orig_parent:
-            name_elem.getparent().remove(name_elem)
-
-
 def delete_empty_fields(orig_etree):
     elems_list = [i for i in orig_etree]
     for elem in elems_list:
@@ -309,30 +497,32 @@ def reorder_node(root_element, target_tagname, subtag_order_dict):
         location_elem.append(i)
 
 
-def saxon_n_cleanup_mods(alias):
+def saxon_n_cleanup_mods(alias, saxon_debug=False, audit_workers=None, report=None, unchanged_docs=None):
+    report = report or RunReport(alias, 'convert')
     alias_xslts = read_alias_xslt_file(alias)
+    audit_docs = []
 
     simples_output_dir = os.path.join('output', '{}_simples'.format(alias))
     if '{}_simples'.format(alias) in os.listdir('output') and 'original_format' in os.listdir(simples_output_dir):
-        flatten_simple_dir(simples_output_dir)
-        run_saxon(simples_output_dir, alias_xslts, 'simple')
-        flat_final_dir = os.path.join(simples_output_dir, 'final_format')
-        validate_mods(alias, flat_final_dir)
-        check_date_format(alias, flat_final_dir)
+        with report.stage('saxon simples') as stage:
+            finished_docs = run_saxon(simples_output_dir, alias_xslts, 'simple', saxon_debug, report=report)
+            stage['items'] = len(finished_docs)
+            stage['bytes'] = sum(os.path.getsize(filepath) for filepath in finished_docs.values())
+        audit_docs.extend((file.split('.')[0], filepath) for file, filepath in finished_docs.items())
     else:
         logging.info('no simple objects in this collection')
 
     compounds_output_dir = os.path.join('output', '{}_compounds'.format(alias))
     if '{}_compounds'.format(alias) in os.listdir('output') and 'original_format' in os.listdir(compounds_output_dir):
-        cpd_output_dir = os.path.join('output', '{}_compounds'.format(alias))
-        flatten_cpd_dir(cpd_output_dir)
-        run_saxon(cpd_output_dir, alias_xslts, 'compound')
-        flat_final_dir = os.path.join(cpd_output_dir, 'post-saxon')
-        validate_mods(alias, flat_final_dir)
-        check_date_format(alias, flat_final_dir)
-        reinflate_cpd_dir(cpd_output_dir)
+        with report.stage('saxon compounds') as stage:
+            finished_docs = run_saxon(compounds_output_dir, alias_xslts, 'compound', saxon_debug, report=report)
+            stage['items'] = len(finished_docs)
+            stage['bytes'] = sum(os.path.getsize(filepath) for filepath in finished_docs.values())
+        audit_docs.extend((file.split('.')[0], filepath) for file, filepath in finished_docs.items())
     else:
         logging.info('no compound objects in this collection')
+    with report.stage('audit', items=len(audit_docs)):
+        audit_mods(alias, audit_docs, audit_workers, report=report, unchanged=unchanged_docs)
 
 
 def read_alias_xslt_file(alias):
@@ -340,108 +530,6 @@ def read_alias_xslt_file(alias):
         return [i for i in f.read().split('\n')]
 
 
-def flatten_simple_dir(simple_dir):
-    orig_format_dir = os.path.join(simple_dir, 'original_format')
-    flattened_dir = os.path.join(simple_dir, 'presaxon_flattened')
-    os.makedirs(flattened_dir, exist_ok=True)
-    for file in os.listdir(orig_format_dir):
-        if '.xml' in file:
-            copyfile(os.path.join(orig_format_dir, file), os.path.join(flattened_dir, file))
-
-
-def run_saxon(output_dir, alias_xslts, cpd_or_simple):
-    starting_dir = os.path.join(output_dir, 'presaxon_flattened')
-    for xslt in alias_xslts:
-        logging.info('doing {} saxon {}'.format(cpd_or_simple.title(), xslt))
-        new_dir = os.path.join(output_dir, xslt)
-        os.makedirs(new_dir, exist_ok=True)
-        path_to_xslt = os.path.join('xsl', '{}.xsl'.format(xslt))
-        subprocess.call(['java',
-                         '-jar',
-                         'saxon9he.jar',
-                         '-s:{}'.format(starting_dir),
-                         '-xsl:{}'.format(path_to_xslt),
-                         '-o:{}'.format(new_dir)])
-        starting_dir = new_dir
-    else:
-        os.makedirs(os.path.join(output_dir, 'post-saxon'), exist_ok=True)
-        for file in os.listdir(os.path.join(output_dir, xslt)):
-            copyfile(os.path.join(output_dir, xslt, file), os.path.join(output_dir, 'post-saxon', file))
-        if cpd_or_simple == 'simple':
-            os.makedirs(os.path.join(output_dir, 'final_format'), exist_ok=True)
-            for file in os.listdir(os.path.join(output_dir, xslt)):
-                copyfile(os.path.join(output_dir, 'post-saxon', file), os.path.join(output_dir, 'final_format', file))
-
-
-def validate_mods(alias, directory):
-    xml_files = [file for file in os.listdir(directory) if ".xml" in file]
-    for file in xml_files:
-        file_etree = ET.parse(os.path.join(directory, file))
-        pointer = file.split('.')[0]
-        if not MODS_SCHEMA.validate(file_etree):
-            logging.warning("{} {} post-xsl did not validate!!!!".format(alias, pointer))
-            break
-    else:
-        logging.info("This group of files post-xsl Validated")
-
-
-def check_date_format(alias, flat_final_dir):
-    item_xml_files = [os.path.join(root, file) for root, dirs, files in os.walk(flat_final_dir)
-                      for file in files if '.xml' in file]
-    for file in item_xml_files:
-        file_etree = ET.parse(file)
-        date_elems = [elem for tag in ('dateCaptured', 'recordChangeDate', 'recordCreationDate', 'dateIssued', 'dateCreated',)
-                      for elem in file_etree.findall('.//{{http://www.loc.gov/mods/v3}}{}'.format(tag))]
-        for i in date_elems:
-            if not good_format_date(i.text):
-                logging.warning('{} {} has bad date: "{}"'.format(file, i.tag.replace('{http://www.loc.gov/mods/v3}', ''), i.text))
-
-
-correct_year_month_day = re.compile(r'^(\d{4})[-](\d{2})[-](\d{2})$')     # 1234-05-06
-correct_year_only = re.compile(r'^(\d{4})$')                              # 3456
-correct_year_month = re.compile(r'^(\d{4})[-](\d{2})$')                   # 1234-05
-
-
-def good_format_date(text):
-        yearmonthday = correct_year_month_day.search(text)
-        yearonly = correct_year_only.search(text)
-        yearmonth = correct_year_month.search(text)
-        if (yearmonthday or yearonly or yearmonth):
-            return True
-        else:
-            return False
-
-
-def flatten_cpd_dir(cpd_dir):
-    orig_format_dir = os.path.join(cpd_dir, 'original_format')
-    flattened_dir = os.path.join(cpd_dir, 'presaxon_flattened')
-    os.makedirs(flattened_dir, exist_ok=True)
-    for root, dirs, files in os.walk(orig_format_dir):
-        for file in files:
-            if ".xml" in file:
-                source_folder_name = os.path.split(root)[-1]
-                dest_filepath = os.path.join(flattened_dir, '{}.xml'.format(source_folder_name))
-                copyfile(os.path.join(root, file), dest_filepath)
-
-
-def reinflate_cpd_dir(cpd_dir):
-    original_format_path = os.path.join(cpd_dir, 'original_format')
-    original_format = [(root, dirs, files) for root, dirs, files in os.walk(original_format_path)]
-    for file in os.listdir(os.path.join(cpd_dir, 'post-saxon')):
-        for root, dirs, files in original_format:
-            if file.split('.')[0] == os.path.split(root)[-1]:
-                source_file = os.path.join(cpd_dir, 'post-saxon', file)
-                dest_path = root.replace('original_format', 'final_format')
-                os.makedirs(dest_path, exist_ok=True)
-                dest_file = os.path.join(dest_path, 'MODS.xml')
-                copyfile(source_file, dest_file)
-    for root, dirs, files in original_format:
-        if 'structure.cpd' in files:
-            source_file = os.path.join(root, 'structure.cpd')
-            dest_file = os.path.join(root.replace('original_format', 'final_format'), 'structure.cpd')
-            copyfile(source_file, dest_file)
-
-
 def write_etree(etree, name):
     os.makedirs('debug_output_xmls', exist_ok=True)
     with open('debug_output_xmls/{}.xml'.format(name), 'w') as f:
@@ -452,14 +540,22 @@ def write_etree(etree, name):
 
 if __name__ == '__main__':
     setup_logging()
-    try:
-        alias = sys.argv[1]
-        cdm_data_dir = sys.argv[2]
-    except IndexError:
-        logging.warning('')
-        logging.warning('Change to: "python convert_cdm_to_mods.py $aliasname $path/to/Cached_Cdm_files"')
-        logging.warning('')
-        quit()
+    parser = argparse.ArgumentParser(usage='python convert_cdm_to_mods.py $aliasname $path/to/Cached_Cdm_files [--workers N] [--saxon-debug] [--incremental] [--reproducible] [--prometheus-dir DIR] [--profile STAGE] [--full-scan]')
+    parser.add_argument('alias')
+    parser.add_argument('cdm_data_dir')
+    parser.add_argument('--workers', type=int, default=1, help='processes used to build the preliminary mods')
+    parser.add_argument('--saxon-debug', action='store_true', help='run one saxon per xslt and keep each step in its own folder')
+    parser.add_argument('--incremental', action='store_true', help='only rebuild pointers whose source changed since the last run')
+    parser.add_argument('--reproducible', action='store_true', help="timestamp dmGetItemInfo with the cached json's mtime instead of now")
+    parser.add_argument('--prometheus-dir', default=None, help='also write the run report as a prometheus textfile in this folder')
+    parser.add_argument('--profile', default=None, metavar='STAGE',
+                        help='run the stages whose names start with STAGE (e.g. "mods build", "audit") under cProfile')
+    parser.add_argument('--slowest', type=int, default=10, help='how many of the slowest pointers to list in the run report')
+    parser.add_argument('--full-scan', action='store_true', help='restat every cached file, to catch files edited in place in folders that look unchanged')
+    args = parser.parse_args()
+    alias = args.alias
     logging.info('starting {}'.format(alias))
-    main(alias, cdm_data_dir)
+    main(alias, args.cdm_data_dir, workers=args.workers, saxon_debug=args.saxon_debug,
+         incremental=args.incremental, reproducible=args.reproducible, prometheus_dir=args.prometheus_dir,
+         profile_stage=args.profile, slowest=args.slowest, full_scan=args.full_scan)
     logging.info('finished {}'.format(alias))
@@ -2,41 +2,60 @@
 # coding=utf-8
 
 import os
-import sys
-import re
-from shutil import copyfile
-import subprocess
+import time
+import heapq
 import datetime
-from copy import deepcopy
 import logging
+import argparse
+import multiprocessing
 
 from lxml import etree as ET
 
-from utilities import parse_xlsx_file
+from utilities import parse_source
+from utilities import source_alias
 from utilities import fix_permissions
+from utilities import alias_output_paths
+from utilities import xlsx_snapshot_path
 from utilities import setup_logging
 from utilities import group_by_simple_cpd
-
-MODS_DEF = ET.parse('schema/mods-3-6.xsd')
-MODS_SCHEMA = ET.XMLSchema(MODS_DEF)
-
-
-def main(xlsx_file):
-    alias = os.path.splitext(os.path.split(xlsx_file)[-1])[0]
+from utilities import compile_mappings
+from utilities import merge_same_fields
+from utilities import split_fields
+from utilities import XLSX_SPLIT_RULES
+from saxon_worker import run_saxon
+from mods_audit import audit_mods
+from run_report import RunReport
+
+
+def main(xlsx_file, saxon_debug=False, workers=1, prometheus_dir=None, profile_stage=None, slowest=10):
+    alias = source_alias(xlsx_file)
+    report = RunReport(alias, 'convert', profile_stage)
     remove_previous_mods(alias)
-    mappings, metadata, xsls = parse_xlsx_file(xlsx_file)
-    simples, compounds = group_by_simple_cpd(metadata)
+    with report.stage('spreadsheet') as stage:
+        mappings, metadata, xsls = parse_source(xlsx_file)
+        report.wrote(xlsx_snapshot_path(xlsx_file))
+        try:
+            mapping_templates = compile_mappings(mappings)
+        except ValueError as e:
+            logging.fatal(f"{e} \n Program cancelled")
+            quit()
+        # metadata streams from the workbook, so grouping it is when the rows are read
+        simples, compounds = group_by_simple_cpd(metadata)
+        stage['items'] = len(simples) + len(compounds)
+    # every row's problem is collected and reported together, rather than stopping at the first
+    failures = []
+    simple_jobs = []
     for item_metadata in simples:
         output_path = os.path.join('output', f"{alias}_simples", 'original_format')
         os.makedirs(output_path, exist_ok=True)
         try:
             output_file = f"{os.path.splitext(item_metadata['FileName'])[0]}.xml"
         except TypeError:
-            logging.fatal(f"{item_metadata['Identifier']} seems to be a simple object but has no 'File Name' in the spreadsheet. \n Program cancelled")
-            quit()
+            failures.append(f"{item_metadata['Identifier']} seems to be a simple object but has no 'File Name' in the spreadsheet.")
+            continue
         output_filepath = os.path.join(output_path, output_file)
-        make_a_single_mods(item_metadata, mappings, output_filepath)
-    logging.info('finished preliminary mods: simples')
+        simple_jobs.append((item_metadata, output_filepath))
+    compound_jobs = []
     for parent_pointer, sub_objects in compounds.items():
         parent_pointer = str(parent_pointer)
         for k, item_metadata in sub_objects.items():
@@ -45,61 +64,143 @@ def main(xlsx_file):
                 os.makedirs(output_path, exist_ok=True)
                 output_file = f"{parent_pointer}.xml"
                 output_filepath = os.path.join(output_path, output_file)
-                make_a_single_mods(item_metadata, mappings, output_filepath)
+                compound_jobs.append((item_metadata, output_filepath))
             else:  # these are all children objects
                 child_pointer = str(item_metadata['Child'])
                 output_path = os.path.join('output', f"{alias}_compounds", 'original_format', parent_pointer, child_pointer)
                 os.makedirs(output_path, exist_ok=True)
-                output_file = f"{os.path.splitext(item_metadata['FileName'])[0]}.xml"
+                try:
+                    output_file = f"{os.path.splitext(item_metadata['FileName'])[0]}.xml"
+                except TypeError:
+                    failures.append(f"{parent_pointer} child {child_pointer} has no 'File Name' in the spreadsheet.")
+                    continue
                 output_filepath = os.path.join(output_path, output_file)
-                make_a_single_mods(item_metadata, mappings, output_filepath)
+                compound_jobs.append((item_metadata, output_filepath))
+    row_seconds = []
+    build_workers = workers
+    if report.is_profiled('mods build simples') or report.is_profiled('mods build compounds'):
+        logging.info(f"profiling the mods build in this process, not with {workers} workers")
+        build_workers = 1
+    with report.stage('mods build simples', items=len(simple_jobs)) as stage:
+        stage['bytes'] = make_all_mods(simple_jobs, mapping_templates, failures, build_workers, row_seconds)
+    logging.info('finished preliminary mods: simples')
+    with report.stage('mods build compounds', items=len(compound_jobs)) as stage:
+        stage['bytes'] = make_all_mods(compound_jobs, mapping_templates, failures, build_workers, row_seconds)
     logging.info('finished preliminary mods: compounds')
-    saxon_n_cleanup_mods(alias, xsls)
-    fix_permissions()
+    if failures:
+        for failure in failures:
+            logging.warning(failure)
+        logging.fatal(f"{len(failures)} rows could not be converted. \n Program cancelled")
+        quit()
+    report.slowest_pointers = describe_slowest_rows(row_seconds, slowest)
+    saxon_n_cleanup_mods(alias, xsls, saxon_debug, report)
+    for output_path in alias_output_paths(alias):
+        report.wrote(output_path)
+    report.write(prometheus_dir)
+    fix_permissions(report.written)
     logging.info('completed')
     logging.info(f"Your output files are in:  output/{alias}_simple/final_format/ and output/{alias}_compounds/final_format/")
 
 
+def make_all_mods(jobs, mapping_templates, failures, workers=1, row_seconds=None):
+    # jobs are (item_metadata, output_filepath); files are written here, in job order, whichever process
+    # built them.  Adds each row's problem to failures and (seconds, row, item_metadata) to row_seconds.
+    # Returns the bytes written.
+    written = 0
+    if workers > 1 and len(jobs) > 1:
+        chunksize = max(1, min(64, len(jobs) // (workers * 8)))
+        with multiprocessing.Pool(workers, initializer=init_mods_worker, initargs=(mapping_templates, )) as pool:
+            for job, (mods_bytes, error, seconds) in zip(jobs, pool.imap(run_mods_job, jobs, chunksize)):
+                written += write_mods_result(job, mods_bytes, error, failures)
+                if row_seconds is not None:
+                    row_seconds.append((seconds, job[0].get('Row'), job[0]))
+    else:
+        init_mods_worker(mapping_templates)
+        for job in jobs:
+            mods_bytes, error, seconds = run_mods_job(job)
+            written += write_mods_result(job, mods_bytes, error, failures)
+            if row_seconds is not None:
+                row_seconds.append((seconds, job[0].get('Row'), job[0]))
+    return written
+
+
+def write_mods_result(job, mods_bytes, error, failures):
+    item_metadata, output_filepath = job
+    if error:
+        failures.append(error)
+        return 0
+    with open(output_filepath, 'wb') as f:
+        f.write(mods_bytes)
+    return len(mods_bytes)
+
+
+mods_worker_ingredients = dict()
+
+
+def init_mods_worker(mapping_templates):
+    mods_worker_ingredients['mapping_templates'] = mapping_templates
+
+
+def run_mods_job(job):
+    item_metadata, output_filepath = job
+    start = time.time()
+    try:
+        return make_a_single_mods(item_metadata, mods_worker_ingredients['mapping_templates']), None, time.time() - start
+    except Exception as e:
+        return None, f"row {item_metadata.get('Row')}: {str(e) or type(e).__name__}", time.time() - start
+
+
+def describe_slowest_rows(row_seconds, slowest=10):
+    # the slowest rows to build, with their biggest fields: usually a huge transcript or hundreds of subjects
+    described = []
+    for seconds, row, item_metadata in heapq.nlargest(slowest, row_seconds, key=lambda i: i[0]):
+        fields = [{'field': k,
+                   'chars': len(v),
+                   'values': len([i for i in v.split(';') if i.strip()]), }
+                  for k, v in item_metadata.items()
+                  if isinstance(v, str) and v]
+        fields.sort(key=lambda field: field['chars'], reverse=True)
+        described.append({'row': row,
+                          'identifier': item_metadata.get('Identifier'),
+                          'seconds': round(seconds, 4),
+                          'largest_fields': fields[:5], })
+    if described:
+        slowest_rows = ', '.join(f"{i['row']} ({i['seconds']:.3f}s)" for i in described)
+        logging.info(f"slowest rows: {slowest_rows}")
+    return described
+
+
 def remove_previous_mods(alias):
+    alias_dirs = [os.path.join('output', f"{alias}_{kind}") for kind in ('simples', 'compounds')]
     xml_files = [f"{root}/{file}"
-                 for root, _, files in os.walk('output')
+                 for alias_dir in alias_dirs
+                 for root, _, files in os.walk(alias_dir)
                  for file in files
-                 if alias in root and ".xml" in file]
+                 if ".xml" in file]
     for file in xml_files:
         os.remove(file)
 
 
-def make_a_single_mods(item_metadata, mappings, output_filepath):
-    mods = build_xml(item_metadata, mappings)
+def make_a_single_mods(item_metadata, mapping_templates):
+    mods = build_xml(item_metadata, mapping_templates)
     merge_same_fields(mods)
-    careful_tag_split(mods, 'name', 'namePart')
-    for sub_subject in ('topic', 'geographic', 'temporal'):
-        careful_tag_split(mods, 'subject', sub_subject)
-    for sub_subject in ("continent", "country", "province", "region", "state", "territory", "county", "city", "citySection", "island", "area"):
-        careful_tag_split(mods, 'hierarchicalGeographic', sub_subject)
+    split_fields(mods, XLSX_SPLIT_RULES)
     delete_empty_fields(mods)
     reorder_title(mods)
     reorder_location(mods)
 
-    mods_bytes = ET.tostring(mods, xml_declaration=True, encoding="utf-8", pretty_print=True)
-    mods_string = mods_bytes.decode('utf-8')
-    with open(output_filepath, 'w', encoding="utf-8") as f:
-        f.write(mods_string)
+    return ET.tostring(mods, xml_declaration=True, encoding="utf-8", pretty_print=True)
 
 
-def build_xml(item_metadata, mappings):
+def build_xml(item_metadata, mapping_templates):
     NSMAP = {None: "http://www.loc.gov/mods/v3",
              'mods': "http://www.loc.gov/mods/v3",
              'xsi': "http://www.w3.org/2001/XMLSchema-instance",
              'xlink': "http://www.w3.org/1999/xlink", }
     root_element = ET.Element("mods", nsmap=NSMAP)
-    for k, v in mappings.items():
-        if not v:
-            # logging.info(f"{k} in Mappings sheet is empty, skipping {k} column")
-            continue
+    for k, template in mapping_templates.items():
         if 'null' in k:
-            new_element = ET.fromstring(v)
-            root_element.append(new_element)
+            root_element.append(template.render())
             continue
         replacement = item_metadata.get(k)
         if not replacement:
@@ -109,58 +210,17 @@ def build_xml(item_metadata, mappings):
             replacement = replacement.strftime('%Y-%m-%d')
         else:
             replacement = str(replacement)
-            for a, b in [('&', '&amp;'),
-                         ('"', '&quot;'),
-                         ('<', '&lt;'),
-                         ('>', '&gt;')]:
-                replacement = replacement.replace(a, b)
-        if "%value%" in v:
-            v = v.replace("%value%", replacement)
-        else:
-            logging.fatal(f"{k}\t{v} in mapping was expected to have a '%value%' variable. \n Program cancelled")
-            quit()
+        if not template.slots:
+            # only a row that fills the field fails, a mapping row nothing uses is left alone
+            raise ValueError(f"{k}\t{template.source} in mapping was expected to have a '%value%' variable.")
         try:
-            new_element = ET.fromstring(v)
-        except ET.XMLSyntaxError:
-            logging.fatal(f"{k} {v} in mapping is malformed. \n Program cancelled")
-            quit()
+            new_element = template.render(replacement)
+        except ValueError:
+            raise ValueError(f"{k} value is not usable as xml text")
         root_element.append(new_element)
     return root_element
 
 
-def merge_same_fields(orig_etree):
-    for elem in orig_etree:
-        for following_elem in elem.itersiblings():
-            if elem.tag == following_elem.tag and elem.attrib == following_elem.attrib:
-                for child in following_elem.iterchildren():
-                    elem.insert(-1, child)
-    return orig_etree
-
-
-def careful_tag_split(etree, parent_tag_name, child_tag_name):
-    # we split the child_tag text into pieces
-    # and create a duplicate parent_tag object for each split child_tag text
-    for name_elem in etree.findall(f".//{parent_tag_name}"):
-        remove_orig_parent = False
-        for child in name_elem.getchildren():
-            if child.tag == child_tag_name:
-                remove_orig_parent = True
-                for split in child.text.split(';'):
-                    split = split.strip()
-                    if not len(split):
-                        continue
-                    new_child_elem = deepcopy(child)
-                    new_child_elem.text = split
-                    copied_name_elem = deepcopy(name_elem)
-                    for i in copied_name_elem:
-                        if i.tag == child_tag_name:
-                            copied_name_elem.remove(i)
-                    copied_name_elem.insert(0, new_child_elem)
-                    name_elem.getparent().append(copied_name_elem)
-        if remove_orig_parent:
-            name_elem.getparent().remove(name_elem)
-
-
 def delete_empty_fields(orig_etree):
     elems_list = [i for i in orig_etree]
     for elem in elems_list:
@@ -201,130 +261,28 @@ def reorder_node(root_element, target_tagname, subtag_order_dict):
         location_elem.append(i)
 
 
-def saxon_n_cleanup_mods(alias, xsls):
+def saxon_n_cleanup_mods(alias, xsls, saxon_debug=False, report=None):
+    report = report or RunReport(alias, 'convert')
+    audit_docs = []
     simples_output_dir = os.path.join('output', f"{alias}_simples")
     if f"{alias}_simples" in os.listdir('output') and 'original_format' in os.listdir(simples_output_dir):
-        flatten_simple_dir(simples_output_dir)
-        run_saxon(simples_output_dir, xsls, 'simple')
-        flat_final_dir = os.path.join(simples_output_dir, 'final_format')
-        validate_mods(alias, flat_final_dir)
-        check_date_format(alias, flat_final_dir)
+        with report.stage('saxon simples') as stage:
+            finished_docs = run_saxon(simples_output_dir, xsls, 'simple', saxon_debug, report=report)
+            stage['items'] = len(finished_docs)
+        audit_docs.extend((file.split('.')[0], filepath) for file, filepath in finished_docs.items())
     else:
         logging.info('no simple objects in this collection')
 
     compounds_output_dir = os.path.join('output', f"{alias}_compounds")
     if f"{alias}_compounds" in os.listdir('output') and 'original_format' in os.listdir(compounds_output_dir):
-        cpd_output_dir = os.path.join('output', f"{alias}_compounds")
-        flatten_cpd_dir(cpd_output_dir)
-        run_saxon(cpd_output_dir, xsls, 'compound')
-        flat_final_dir = os.path.join(cpd_output_dir, 'post-saxon')
-        validate_mods(alias, flat_final_dir)
-        check_date_format(alias, flat_final_dir)
-        reinflate_cpd_dir(cpd_output_dir)
+        with report.stage('saxon compounds') as stage:
+            finished_docs = run_saxon(compounds_output_dir, xsls, 'compound', saxon_debug, report=report)
+            stage['items'] = len(finished_docs)
+        audit_docs.extend((file.split('.')[0], filepath) for file, filepath in finished_docs.items())
     else:
         logging.info('no compound objects in this collection')
-
-
-def flatten_simple_dir(simple_dir):
-    orig_format_dir = os.path.join(simple_dir, 'original_format')
-    flattened_dir = os.path.join(simple_dir, 'presaxon_flattened')
-    os.makedirs(flattened_dir, exist_ok=True)
-    for file in os.listdir(orig_format_dir):
-        if '.xml' in file:
-            copyfile(os.path.join(orig_format_dir, file), os.path.join(flattened_dir, file))
-
-
-def run_saxon(output_dir, xsls, cpd_or_simple):
-    starting_dir = os.path.join(output_dir, 'presaxon_flattened')
-    for xslt in xsls:
-        logging.info(f"doing {cpd_or_simple.title()} saxon {xslt}")
-        new_dir = os.path.join(output_dir, xslt)
-        os.makedirs(new_dir, exist_ok=True)
-        path_to_xslt = os.path.join('xsl', f"{xslt}.xsl")
-        subprocess.call(['java',
-                         '-jar',
-                         'saxon9he.jar',
-                         f"-s:{starting_dir}",
-                         f"-xsl:{path_to_xslt}",
-                         f"-o:{new_dir}"])
-        starting_dir = new_dir
-    else:
-        os.makedirs(os.path.join(output_dir, 'post-saxon'), exist_ok=True)
-        for file in os.listdir(os.path.join(output_dir, xslt)):
-            copyfile(os.path.join(output_dir, xslt, file), os.path.join(output_dir, 'post-saxon', file))
-        if cpd_or_simple == 'simple':
-            os.makedirs(os.path.join(output_dir, 'final_format'), exist_ok=True)
-            for file in os.listdir(os.path.join(output_dir, xslt)):
-                copyfile(os.path.join(output_dir, 'post-saxon', file), os.path.join(output_dir, 'final_format', file))
-
-
-def validate_mods(alias, directory):
-    xml_files = [file for file in os.listdir(directory) if ".xml" in file]
-    for file in xml_files:
-        file_etree = ET.parse(os.path.join(directory, file))
-        pointer = file.split('.')[0]
-        if not MODS_SCHEMA.validate(file_etree):
-            logging.warning(f"{alias} item '{pointer}' post-xsl did not validate!!!!")
-            break
-    else:
-        logging.info("This group of files post-xsl Validated")
-
-
-def check_date_format(alias, flat_final_dir):
-    item_xml_files = [os.path.join(root, file) for root, dirs, files in os.walk(flat_final_dir)
-                      for file in files if '.xml' in file]
-    for file in item_xml_files:
-        file_etree = ET.parse(file)
-        date_elems = [elem for tag in ('dateCaptured', 'recordChangeDate', 'recordCreationDate', 'dateIssued', 'dateCreated',)
-                      for elem in file_etree.findall(f".//{{http://www.loc.gov/mods/v3}}{tag}")]
-        for i in date_elems:
-            if not is_valid_date(i.text):
-                logging.warning(f"{file} {i.tag.replace('{http://www.loc.gov/mods/v3}', '')} has bad date: '{i.text}'")
-
-
-correct_year_month_day = re.compile(r'^(\d{4})[-](\d{2})[-](\d{2})$')     # 1234-05-06
-correct_year_only = re.compile(r'^(\d{4})$')                              # 3456
-correct_year_month = re.compile(r'^(\d{4})[-](\d{2})$')                   # 1234-05
-
-
-def is_valid_date(text):
-    yearmonthday = correct_year_month_day.search(text)
-    yearonly = correct_year_only.search(text)
-    yearmonth = correct_year_month.search(text)
-    if (yearmonthday or yearonly or yearmonth):
-        return True
-    else:
-        return False
-
-
-def flatten_cpd_dir(cpd_dir):
-    orig_format_dir = os.path.join(cpd_dir, 'original_format')
-    flattened_dir = os.path.join(cpd_dir, 'presaxon_flattened')
-    os.makedirs(flattened_dir, exist_ok=True)
-    for root, dirs, files in os.walk(orig_format_dir):
-        for file in files:
-            if ".xml" in file:
-                source_folder_name = os.path.split(root)[-1]
-                dest_filepath = os.path.join(flattened_dir, f"{source_folder_name}.xml")
-                copyfile(os.path.join(root, file), dest_filepath)
-
-
-def reinflate_cpd_dir(cpd_dir):
-    original_format_path = os.path.join(cpd_dir, 'original_format')
-    original_format = [(root, dirs, files) for root, dirs, files in os.walk(original_format_path)]
-    for file in os.listdir(os.path.join(cpd_dir, 'post-saxon')):
-        for root, dirs, files in original_format:
-            if file.split('.')[0] == os.path.split(root)[-1]:
-                source_file = os.path.join(cpd_dir, 'post-saxon', file)
-                dest_path = root.replace('original_format', 'final_format')
-                os.makedirs(dest_path, exist_ok=True)
-                dest_file = os.path.join(dest_path, 'MODS.xml')
-                copyfile(source_file, dest_file)
-    for root, dirs, files in original_format:
-        if 'structure.cpd' in files:
-            source_file = os.path.join(root, 'structure.cpd')
-            dest_file = os.path.join(root.replace('original_format', 'final_format'), 'structure.cpd')
-            copyfile(source_file, dest_file)
+    with report.stage('audit', items=len(audit_docs)):
+        audit_mods(alias, audit_docs, report=report)
 
 
 def write_etree(etree, name):
@@ -337,11 +295,17 @@ def write_etree(etree, name):
 
 if __name__ == '__main__':
     setup_logging()
-    try:
-        xlsx = sys.argv[1]
-    except IndexError:
-        logging.warning('Change to: "python convert_xlsx_to_mods.py $path/to/{filename}.xlsx"')
-        quit()
+    parser = argparse.ArgumentParser(usage='python convert_xlsx_to_mods.py ($path/to/{filename}.xlsx | $path/to/{alias}/) [--workers N] [--saxon-debug] [--prometheus-dir DIR] [--profile STAGE]')
+    parser.add_argument('xlsx', help='a spreadsheet, or a folder of Mappings, Metadata and Xsls .csv/.tsv/.jsonl files')
+    parser.add_argument('--workers', type=int, default=1, help='processes used to build the preliminary mods')
+    parser.add_argument('--saxon-debug', action='store_true', help='run one saxon per xslt and keep each step in its own folder')
+    parser.add_argument('--prometheus-dir', default=None, help='also write the run report as a prometheus textfile in this folder')
+    parser.add_argument('--profile', default=None, metavar='STAGE',
+                        help='run the stages whose names start with STAGE (e.g. "mods build", "audit") under cProfile')
+    parser.add_argument('--slowest', type=int, default=10, help='how many of the slowest rows to list in the run report')
+    args = parser.parse_args()
+    xlsx = args.xlsx
     logging.info(f"starting {xlsx}")
-    main(xlsx)
+    main(xlsx, saxon_debug=args.saxon_debug, workers=args.workers, prometheus_dir=args.prometheus_dir,
+         profile_stage=args.profile, slowest=args.slowest)
     logging.info(f"finished {xlsx}")
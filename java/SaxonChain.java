@@ -0,0 +1,119 @@
+// Long-lived Saxon worker used by saxon_worker.py
+//
+// Run with:  java -cp saxon9he.jar java/SaxonChain.java
+//
+// Reads one request per line on stdin:
+//     xsl/first.xsl|xsl/second.xsl|...<TAB>input.xml<TAB>output.xml
+// pushes the input through every stylesheet in order, in memory, and writes
+// only the last result.  Each stylesheet is compiled once and kept for the
+// life of the process.  Answers every request with one line on stdout:
+//     OK<TAB>input.xml<TAB>nanoseconds in each stylesheet, comma separated
+//     ERR<TAB>input.xml<TAB>message
+
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+import java.util.HashMap;
+import java.util.Map;
+
+import javax.xml.transform.stream.StreamSource;
+
+import net.sf.saxon.s9api.Processor;
+import net.sf.saxon.s9api.SaxonApiException;
+import net.sf.saxon.s9api.Serializer;
+import net.sf.saxon.s9api.XdmDestination;
+import net.sf.saxon.s9api.XdmNode;
+import net.sf.saxon.s9api.XsltCompiler;
+import net.sf.saxon.s9api.XsltExecutable;
+import net.sf.saxon.s9api.XsltTransformer;
+
+public class SaxonChain {
+
+    private final Processor processor = new Processor(false);
+    private final XsltCompiler compiler = processor.newXsltCompiler();
+    private final Map<String, XsltExecutable> stylesheets = new HashMap<>();
+
+    public static void main(String[] args) throws IOException {
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        new SaxonChain().serve(in, out);
+    }
+
+    private void serve(BufferedReader in, PrintStream out) throws IOException {
+        out.println("READY");
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            String[] request = line.split("\t", -1);
+            if (request.length != 3) {
+                out.println("ERR\t" + line.replace('\t', ' ') + "\tmalformed request");
+                continue;
+            }
+            String[] chain = request[0].isEmpty() ? new String[0] : request[0].split("\\|");
+            long[] stepNanos = new long[chain.length];
+            try {
+                transform(chain, new File(request[1]), new File(request[2]), stepNanos);
+                out.println("OK\t" + request[1] + "\t" + joinNanos(stepNanos));
+            } catch (SaxonApiException | RuntimeException e) {
+                out.println("ERR\t" + request[1] + "\t" + oneLine(e));
+            }
+        }
+    }
+
+    private XsltExecutable stylesheet(String path) throws SaxonApiException {
+        XsltExecutable executable = stylesheets.get(path);
+        if (executable == null) {
+            executable = compiler.compile(new StreamSource(new File(path)));
+            stylesheets.put(path, executable);
+        }
+        return executable;
+    }
+
+    private void transform(String[] chain, File input, File output, long[] stepNanos) throws SaxonApiException {
+        XdmNode document = processor.newDocumentBuilder().build(input);
+        Serializer serializer = processor.newSerializer(output);
+        if (chain.length == 0) {
+            processor.writeXdmValue(document, serializer);
+            return;
+        }
+        for (int i = 0; i < chain.length; i++) {
+            long start = System.nanoTime();
+            XsltTransformer transformer = stylesheet(chain[i]).load();
+            transformer.setInitialContextNode(document);
+            if (i == chain.length - 1) {
+                transformer.setDestination(serializer);
+                transformer.transform();
+            } else {
+                XdmDestination result = new XdmDestination();
+                result.setBaseURI(input.toURI());
+                transformer.setDestination(result);
+                transformer.transform();
+                document = result.getXdmNode();
+            }
+            stepNanos[i] = System.nanoTime() - start;
+        }
+    }
+
+    private static String joinNanos(long[] stepNanos) {
+        StringBuilder joined = new StringBuilder();
+        for (int i = 0; i < stepNanos.length; i++) {
+            if (i > 0) {
+                joined.append(',');
+            }
+            joined.append(stepNanos[i]);
+        }
+        return joined.toString();
+    }
+
+    private static String oneLine(Exception e) {
+        String message = e.getMessage() == null ? e.getClass().getName() : e.getMessage();
+        return message.replace('\t', ' ').replace('\r', ' ').replace('\n', ' ');
+    }
+}
@@ -0,0 +1,141 @@
+#! /usr/bin/env python3
+
+import os
+import re
+import json
+import time
+import logging
+import multiprocessing
+
+from lxml import etree as ET
+
+from saxon_worker import count_cpus
+
+
+MODS_XSD = os.path.join('schema', 'mods-3-6.xsd')
+MODS_SCHEMA = None  # compiled by mods_schema() the first time a process validates
+MODS_NS = '{http://www.loc.gov/mods/v3}'
+DATE_TAGS = ('dateCaptured', 'recordChangeDate', 'recordCreationDate', 'dateIssued', 'dateCreated',)
+MIN_FILES_PER_WORKER = 50
+
+correct_year_month_day = re.compile(r'^(\d{4})[-](\d{2})[-](\d{2})$')     # 1234-05-06
+correct_year_only = re.compile(r'^(\d{4})$')                              # 3456
+correct_year_month = re.compile(r'^(\d{4})[-](\d{2})$')                   # 1234-05
+
+
+def audit_mods(alias, documents, workers=None, report=None, unchanged=None):
+    # documents are (pointer, filepath); every file is parsed once for both the schema and the date checks.
+    # unchanged are (pointer, filepath) an incremental run didn't rebuild: not checked again, but they
+    # keep their failures from the previous report, so it still covers every file.
+    documents = sorted(documents)
+    unchanged = unchanged or []
+    if not workers:
+        workers = min(count_cpus(), -(-len(documents) // MIN_FILES_PER_WORKER))
+    if multiprocessing.current_process().daemon:
+        workers = 1
+    # compiled before the pool forks, so the workers inherit it instead of each compiling their own
+    mods_schema()
+    if workers > 1 and len(documents) > 1:
+        chunksize = max(1, min(64, len(documents) // (workers * 8)))
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(audit_a_single_mods, documents, chunksize)
+    else:
+        results = [audit_a_single_mods(document) for document in documents]
+    if report is not None:
+        # summed over the workers
+        for name in ('parse', 'schema', 'dates'):
+            report.add_stage('audit {}'.format(name), sum(result['seconds'][name] for result in results), items=len(results))
+    for result in results:
+        del result['seconds']
+
+    failures = [result for result in results if result['schema_errors'] or result['bad_dates']]
+    for failure in failures:
+        if failure['schema_errors']:
+            logging.warning("{} {} post-xsl did not validate!!!!".format(alias, failure['pointer']))
+            for error in failure['schema_errors']:
+                logging.warning('    line {}: {}'.format(error['line'], error['message']))
+        for bad_date in failure['bad_dates']:
+            logging.warning('{} {} has bad date: "{}"'.format(failure['file'], bad_date['tag'], bad_date['text']))
+    failures = previous_failures(alias, unchanged) + failures
+    report_path = write_audit_report(alias, len(documents) + len(unchanged), failures)
+    if report is not None:
+        report.wrote(report_path)
+    if failures:
+        logging.warning('{} of {} files failed the audit, see {}'.format(len(failures), len(documents) + len(unchanged), report_path))
+    else:
+        logging.info("This group of files post-xsl Validated")
+    return failures
+
+
+def audit_a_single_mods(document):
+    pointer, filepath = document
+    result = {'pointer': pointer, 'file': filepath, 'schema_errors': [], 'bad_dates': [],
+              'seconds': {'parse': 0.0, 'schema': 0.0, 'dates': 0.0}}
+    start = time.time()
+    try:
+        file_etree = ET.parse(filepath)
+    except (OSError, ET.XMLSyntaxError) as e:
+        result['schema_errors'].append({'line': getattr(e, 'lineno', 0), 'message': str(e)})
+        return result
+    finally:
+        result['seconds']['parse'] = time.time() - start
+    start = time.time()
+    schema = mods_schema()
+    if not schema.validate(file_etree):
+        result['schema_errors'] = [{'line': error.line, 'message': error.message} for error in schema.error_log]
+    result['seconds']['schema'] = time.time() - start
+    start = time.time()
+    for tag in DATE_TAGS:
+        for elem in file_etree.iterfind('.//{}{}'.format(MODS_NS, tag)):
+            if not good_format_date(elem.text):
+                result['bad_dates'].append({'tag': tag, 'text': elem.text or '', 'line': elem.sourceline})
+    result['seconds']['dates'] = time.time() - start
+    return result
+
+
+def mods_schema():
+    global MODS_SCHEMA
+    if MODS_SCHEMA is None:
+        MODS_SCHEMA = ET.XMLSchema(ET.parse(MODS_XSD))
+    return MODS_SCHEMA
+
+
+def good_format_date(text):
+    if not text:
+        return False
+    yearmonthday = correct_year_month_day.search(text)
+    yearonly = correct_year_only.search(text)
+    yearmonth = correct_year_month.search(text)
+    if (yearmonthday or yearonly or yearmonth):
+        return True
+    else:
+        return False
+
+
+def previous_failures(alias, unchanged):
+    if not unchanged:
+        return []
+    try:
+        with open(audit_report_path(alias), 'r', encoding='utf-8') as f:
+            previous = json.loads(f.read())
+    except (OSError, ValueError):
+        logging.warning('no audit report from a previous run, {} unchanged files are not in this one'.format(len(unchanged)))
+        return []
+    unchanged_files = {os.path.normpath(filepath) for pointer, filepath in unchanged}
+    return [failure for failure in previous.get('failures', []) if os.path.normpath(failure['file']) in unchanged_files]
+
+
+def audit_report_path(alias):
+    return os.path.join('output', '{}_audit.json'.format(alias))
+
+
+def write_audit_report(alias, checked, failures):
+    report_path = audit_report_path(alias)
+    os.makedirs('output', exist_ok=True)
+    report = {'alias': alias,
+              'checked': checked,
+              'failed': len(failures),
+              'failures': failures, }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(report, indent=1))
+    return report_path
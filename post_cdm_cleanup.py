@@ -1,22 +1,31 @@
 #! /usr/bin/env python3
 
 import os
-import sys
 import shutil
 import logging
-import json
+import argparse
 
+from utilities import CdmPathIndex
+from utilities import StructureCache
+from utilities import items_sidecar_path
+from utilities import read_items_sidecar
 from utilities import fix_permissions
+from utilities import folder_zip_entries
+from utilities import extension_zip_entries
+from utilities import write_zips
 from utilities import setup_logging
+from run_report import RunReport
+from run_report import tree_size
 
 from lxml import etree as ET
 
 
 class IsCountsCorrect():
-    def __init__(self, alias, cdm_data_dir):
-        elems_json_filelist = self.make_list_of_elem_jsons(alias, cdm_data_dir)
+    def __init__(self, alias, cdm_data_dir, path_index=None):
+        self.path_index = path_index or CdmPathIndex(os.path.join(cdm_data_dir, alias))
+        elems_json_filelist = self.make_list_of_elem_jsons()
         elems_in_coll_cpds = self.name_root_compounds_json(elems_json_filelist)
-        all_exp_children, all_exp_parents, all_exp_compounds = self.lookup_expected_cpds(alias, cdm_data_dir, elems_in_coll_cpds)
+        all_exp_children, all_exp_parents, all_exp_compounds = self.lookup_expected_cpds(elems_in_coll_cpds)
         exp_root_count = self.get_root_count(elems_json_filelist)
         exp_simples = exp_root_count - len(all_exp_parents)
         all_obs_simples = self.count_observed_simples(alias)
@@ -36,17 +45,11 @@ class IsCountsCorrect():
             quit()
         logging.info('IsCountsCorrect done')
 
-    def make_list_of_elem_jsons(self, alias, cdm_data_dir):
-        input_dir = os.path.join(cdm_data_dir, alias)
-        return [os.path.join(input_dir, file) for file in os.listdir(input_dir)
-                if 'Elems_in_Collection' in file and '.json' in file]
+    def make_list_of_elem_jsons(self):
+        return self.path_index.root_elems_in_collection()
 
     def get_root_count(self, elems_json_filelist):
-        named_total = set()
-        for file in elems_json_filelist:
-            with open(file, 'r', encoding='utf-8') as f:
-                parsed_json = json.loads(f.read())
-            named_total.add(parsed_json['pager']['total'])
+        named_total = set(self.path_index.catalog.elems_totals(elems_json_filelist))
         if len(named_total) == 1:
             return named_total.pop()
         else:
@@ -54,29 +57,22 @@ class IsCountsCorrect():
             return False
 
     def name_root_compounds_json(self, elems_json_filelist):
-        compound_pointers = []
-        for file in elems_json_filelist:
-            with open(file, 'r', encoding='utf-8') as f:
-                parsed_json = json.loads(f.read())
-            for item in parsed_json['records']:
-                if item["filetype"] == "cpd":
-                    pointer = item['pointer'] or item['dmrecord']
-                    compound_pointers.append(str(pointer))
-        return compound_pointers
-
-    def lookup_expected_cpds(self, alias, cdm_data_dir, elems_in_coll_cpds):
+        return [pointer for pointer, filetype in self.path_index.catalog.records(elems_json_filelist) if filetype == 'cpd']
+
+    def lookup_expected_cpds(self, elems_in_coll_cpds):
         all_child_pointers = [i for parent in elems_in_coll_cpds
-                              for i in self.count_child_pointers(alias, parent, cdm_data_dir)]
+                              for i in self.count_child_pointers(parent)]
         root_cpd_pointers = [os.path.splitext(i)[0] for i in elems_in_coll_cpds]
         all_cpd_pointers = list(all_child_pointers)
         all_cpd_pointers.extend(root_cpd_pointers)
         return all_child_pointers, root_cpd_pointers, all_cpd_pointers
 
-    def count_child_pointers(self, alias, cpd_pointer, cdm_data_dir):
-        structure_file = os.path.abspath(os.path.join(cdm_data_dir, alias, 'Cpd/{}_cpd.xml'.format(cpd_pointer)))
-        structure_etree = ET.parse(structure_file)
-        child_pointers = [i.text for i in structure_etree.findall('//pageptr') if i.text]
-        return child_pointers
+    def count_child_pointers(self, cpd_pointer):
+        child_pointers = self.path_index.catalog.children(cpd_pointer)
+        if child_pointers is None:
+            logging.warning('BIG DEAL:  compound {} has no {}_cpd.xml'.format(cpd_pointer, cpd_pointer))
+            quit()
+        return [i for i in child_pointers if i]
 
     def count_observed_simples(self, alias):
         output_dir = os.path.join('output', '{}_simples'.format(alias), 'final_format')
@@ -96,181 +92,105 @@ class IsCountsCorrect():
 
 
 class PullInBinaries():
-    def __init__(self, alias, cdm_data_dir):
-        sourcefiles_paths = self.makedict_sourcefiles(alias, cdm_data_dir)
-        simplexmls_list = self.makelist_simpleoutfolderxmls(alias)
-        compoundxmls_list = self.makelist_compoundoutfolderxmls(alias)
-        for filelist in (simplexmls_list, compoundxmls_list):
-            for kind, outroot, pointer in filelist:
-                if pointer not in sourcefiles_paths:
-                    if kind == "compound" and os.path.split(os.path.split(outroot)[0])[1] == "final_format":
-                        continue  # root of cpd is expected to have no binary
-                    else:
-                        logging.warning("{} pointer {} has no matching binary".format(kind, pointer))
-                        quit()
-                if self.is_binary_in_output_dir(kind, outroot, pointer):
-                    continue
-                if pointer not in sourcefiles_paths:
-                    continue
-                sourcepath, sourcefile = sourcefiles_paths[pointer]
-                self.copy_binary(kind, sourcepath, sourcefile, outroot, pointer)
+    def __init__(self, alias, cdm_data_dir, items, path_index=None):
+        self.path_index = path_index or CdmPathIndex(os.path.join(cdm_data_dir, alias))
+        sourcefiles_paths = self.makedict_sourcefiles()
+        # {path the binary has in final_format: source binary}; make_zips reads the sources, so nothing is copied
+        self.binaries = dict()
+        for item in items:
+            kind, pointer = ('simple' if item['kind'] == 'simple' else 'compound'), item['pointer']
+            outroot = os.path.split(os.path.abspath(item['mods']))[0]
+            if pointer not in sourcefiles_paths:
+                if item['kind'] == 'compound':
+                    continue  # root of cpd is expected to have no binary
+                else:
+                    logging.warning("{} pointer {} has no matching binary".format(kind, pointer))
+                    quit()
+            sourcepath, sourcefile = sourcefiles_paths[pointer]
+            self.binaries[self.binary_destination(kind, sourcefile, outroot)] = os.path.join(sourcepath, sourcefile)
         logging.info('PullInBinaries done')
 
-    def makedict_sourcefiles(self, alias, cdm_data_dir):
-        sourcefiles_paths = dict()
-        input_dir = os.path.join(cdm_data_dir, alias)
-        for root, dirs, files in os.walk(input_dir):
-            for file in files:
-                filename, extension = os.path.splitext(file)
-                if extension.lower() in ('.jp2', '.mp4', '.mp3', '.pdf'):
-                    if filename in sourcefiles_paths:
-                        logging.warning("pointer {} has multiple possible source binaries -- please cull unwanted version".format(filename))
-                        quit()
-                    sourcefiles_paths[filename] = (root, file)
-        return sourcefiles_paths
-
-    def makelist_simpleoutfolderxmls(self, alias):
-        xml_filelist = []
-        subfolder = os.path.abspath(os.path.join('output', '{}_simples'.format(alias), 'final_format'))
-        for root, dirs, files in os.walk(subfolder):
-            for file in files:
-                if '.xml' in file:
-                    pointer = file.split('.')[0]
-                    xml_filelist.append(('simple', root, pointer))
-        return xml_filelist
-
-    def makelist_compoundoutfolderxmls(self, alias):
-        xml_filelist = []
-        subfolder = os.path.abspath(os.path.join('output', '{}_compounds'.format(alias), 'final_format'))
-        for root, dirs, files in os.walk(subfolder):
-            for file in files:
-                if file == 'MODS.xml':
-                    pointer = os.path.split(root)[-1]
-                    xml_filelist.append(('compound', root, pointer))
-        return xml_filelist
+    def makedict_sourcefiles(self):
+        for pointer in sorted(self.path_index.duplicate_binaries()):
+            logging.warning("pointer {} has multiple possible source binaries -- please cull unwanted version".format(pointer))
+            quit()
+        return {pointer: paths[0] for pointer, paths in self.path_index.binaries.items()}
 
-    def is_binary_in_output_dir(self, kind, root, pointer):
-        acceptable_binary_types = ('mp3', 'mp4', 'jp2', 'pdf')
+    def binary_destination(self, kind, sourcefile, outroot):
         if kind == 'simple':
-            for filetype in acceptable_binary_types:
-                if os.path.isfile(os.path.join(root, '{}.{}'.format(pointer, filetype))):
-                    return True
-        if kind == 'compound':
-            for filetype in acceptable_binary_types:
-                if os.path.isfile(os.path.join(root, pointer, 'OBJ.{}'.format(filetype))):
-                    return True
-        return False
-
-    def copy_binary(self, kind, sourcepath, sourcefile, outroot, pointer):
-        if kind == 'simple':
-            shutil.copyfile(os.path.join(sourcepath, sourcefile), os.path.join(outroot, sourcefile))
-        elif kind == 'compound':
-            shutil.copyfile(os.path.join(sourcepath, sourcefile), os.path.join(outroot, "OBJ.{}".format(sourcefile.split('.')[-1])))
+            return os.path.join(outroot, sourcefile)
+        return os.path.join(outroot, "OBJ.{}".format(sourcefile.split('.')[-1]))
 
 
 class MakeStructureFile():
-    def __init__(self, alias):
-        for root, dirs, files in os.walk('output'):
-            if 'structure.cpd' in files:
-                parent = os.path.split(root)[-1]
-                new_etree = ET.Element("islandora_compound_object", title=parent)
-                old_etree = ET.parse("{}/structure.cpd".format(root))
-                for i in old_etree.findall('.//pageptr'):
-                    new_etree.append(ET.Element('child', content='{}/{}'.format(parent, i.text)))
-
-                with open('{}/structure.xml'.format(root), 'wb') as f:
-                    f.write(ET.tostring(new_etree, encoding="utf-8", xml_declaration=True, pretty_print=True))
+    def __init__(self, alias, path_index):
+        # children come from the catalog, not from reparsing structure.cpd
+        self.path_index = path_index
+        compounds_dir = os.path.join('output', '{}_compounds'.format(alias), 'final_format')
+        parents = sorted(i for i in os.listdir(compounds_dir)) if os.path.isdir(compounds_dir) else []
+        for parent in parents:
+            root = os.path.join(compounds_dir, parent)
+            if not os.path.isfile(os.path.join(root, 'structure.cpd')):
+                continue
+            new_etree = ET.Element("islandora_compound_object", title=parent)
+            for child in self.children(parent, root):
+                new_etree.append(ET.Element('child', content='{}/{}'.format(parent, child)))
+
+            with open('{}/structure.xml'.format(root), 'wb') as f:
+                f.write(ET.tostring(new_etree, encoding="utf-8", xml_declaration=True, pretty_print=True))
         logging.info('MakeStructureFile done')
 
+    def children(self, parent, root):
+        children = self.path_index.catalog.children(parent)
+        if children is None:
+            children = StructureCache.parse(os.path.join(root, 'structure.cpd'))['children']
+        return children
+
 
-def report_restricted_files(alias):
-    restrictions_dict = dict()
-    all_metadatas = []
-    simples_metadatas = ["{}/{}".format(root, file)
-                         for root, dirs, files in os.walk('output/{}_simples/final_format'.format(alias))
-                         for file in files
-                         if '.xml' in file]
-    all_metadatas.extend(simples_metadatas)
-    compounds_metadatas = ["{}/{}".format(root, file)
-                           for root, dirs, files in os.walk('output/{}_compounds/final_format'.format(alias))
-                           for file in files
-                           if '.xml' in file]
-    all_metadatas.extend(compounds_metadatas)
-    for mods in all_metadatas:
-        pointer = os.path.split(mods)[-1]
-        mods_etree = ET.parse(mods).getroot()
-        for child in mods_etree.iterfind('.//{http://www.loc.gov/mods/v3}dmGetItemInfo'):
-            original_metadata = json.loads(child.text)
-            restriction = original_metadata['dmaccess']
-            if restriction:
-                restrictions_dict[pointer] = restriction
+def report_restricted_files(alias, items, catalog):
+    # dmaccess was noted in the catalog by the conversion; reported for exactly the pointers it converted
+    restrictions = catalog.restrictions()
+    restrictions_dict = {item['pointer']: restrictions[item['pointer']] for item in items if item['pointer'] in restrictions}
     if restrictions_dict:
         output_text = ''
-        with open('output/{}_restrictions.txt'.format(alias), 'w') as f:
+        restrictions_path = 'output/{}_restrictions.txt'.format(alias)
+        with open(restrictions_path, 'w') as f:
             for k, v in restrictions_dict.items():
-                output_text += '{}: {}\n'.format(k.replace('.xml', ''), v)
+                output_text += '{}: {}\n'.format(k, v)
             f.write(output_text)
         logging.info('report_restricted_files done')
         logging.warning('Add a "Restricted" Label to the {} ETL card'.format(alias))
         logging.warning('Add output/{}_restrictions.txt to the card'.format(alias))
+        return restrictions_path
     else:
         logging.info('report_restricted_files done.')
         logging.info('No restricted items.')
 
 
-def report_filetype(alias):
-    filetypes = set()
-    all_binaries = []
-    simples_binaries = ["{}/{}".format(root, file)
-                        for root, dirs, files in os.walk('output/{}_simples/final_format'.format(alias))
-                        for file in files
-                        if '.xml' not in file]
-    all_binaries.extend(simples_binaries)
-    compounds_binaries = ["{}/{}".format(root, file)
-                          for root, dirs, files in os.walk('output/{}_compounds/final_format'.format(alias))
-                          for file in files
-                          if '.xml' not in file]
-    all_binaries.extend(compounds_binaries)
-    for binary_filename in all_binaries:
-        filetypes.add(binary_filename.split('.')[-1])
+def report_filetype(alias, items):
+    # each pointer's 'find' extension, noted by the conversion; a compound's is cpd, as its structure.cpd was counted before
+    filetypes = {item['filetype'] for item in items if item.get('filetype')}
     logging.info('Collection contains filetypes: {}'.format(filetypes))
 
 
-def folder_by_extension(alias):
-    starting_folder = os.path.join('output', '{}_simples'.format(alias), 'final_format')
-    if not os.path.isdir(starting_folder):
-        return
-    files = [i for i in os.listdir(starting_folder) if os.path.isfile(os.path.join(starting_folder, i))]
-    extensions = {i.split(".")[1] for i in files if i.split(".")[1] != 'xml'}
-    for extension in extensions:
-        dest_folder = os.path.join(starting_folder, extension)
-        if os.path.isdir(os.path.realpath(dest_folder)):
-            shutil.rmtree(dest_folder)
-        os.makedirs(dest_folder, exist_ok=True)
-        files_limited_to_extension = {file.split('.')[0] for file in files if file.split('.')[1] == extension}
-        files_with_extension_plus_samenames = [file for file in files if file.split('.')[0] in files_limited_to_extension]
-        for file in files_with_extension_plus_samenames:
-            shutil.copyfile(os.path.join(starting_folder, file), os.path.join(dest_folder, file))
-
-
-def make_zips(alias):
+def group_by_extension(alias, binaries):
+    return extension_zip_entries(os.path.join('output', '{}_simples'.format(alias), 'final_format'), binaries)
+
+
+def make_zips(alias, binaries):
+    zips = dict()
     os.makedirs('Upload_to_Islandora', exist_ok=True)
     institution = lookup_institution(alias)
     inst_alias = dont_repeat_inst(institution.lower(), alias.lower())
     cpd_output = 'output/{}_compounds/final_format'.format(alias)
     if os.path.isdir(cpd_output):
-        zipfilename = 'Upload_to_Islandora/{}-cpd'.format(inst_alias)
-        shutil.make_archive(zipfilename, 'zip', cpd_output)
-        logging.info('{}.zip created'.format(zipfilename))
-
-    simple_output = 'output/{}_simples/final_format'.format(alias)
-    if os.path.isdir(simple_output):
-        subdirs = [i for i in os.listdir(simple_output) if os.path.isdir(os.path.join(simple_output, i))]
-        for subdir in subdirs:
-            subdir_path = os.path.join(simple_output, subdir)
-            zipfilename = 'Upload_to_Islandora/{}-{}'.format(inst_alias, subdir)
-            shutil.make_archive(zipfilename, 'zip', subdir_path)
-            logging.info('{}.zip created'.format(zipfilename))
+        zips['Upload_to_Islandora/{}-cpd.zip'.format(inst_alias)] = folder_zip_entries(cpd_output, binaries)
+    for extension, entries in group_by_extension(alias, binaries).items():
+        zips['Upload_to_Islandora/{}-{}.zip'.format(inst_alias, extension)] = entries
+    written = write_zips(zips)
+    for zip_path in written:
+        logging.info('{} created'.format(zip_path))
+    return written
 
 
 def dont_repeat_inst(inst, alias):
@@ -328,30 +248,50 @@ def cleanup_leftover_files(alias):
     logging.info('intermediate folders deleted')
 
 
-def main(alias, cdm_data_dir):
-    PullInBinaries(alias, cdm_data_dir)
-    MakeStructureFile(alias)
-    IsCountsCorrect(alias, cdm_data_dir)
-    report_restricted_files(alias)
-    report_filetype(alias)
-    folder_by_extension(alias)
-    make_zips(alias)
-    fix_permissions()
-    cleanup_leftover_files(alias)
+def main(alias, cdm_data_dir, prometheus_dir=None):
+    report = RunReport(alias, 'cleanup')
+    with report.stage('pointer discovery') as stage:
+        path_index = CdmPathIndex(os.path.join(cdm_data_dir, alias))
+        report.wrote(path_index.catalog.db_path)
+        items = read_items_sidecar(alias)
+        if not items:
+            logging.warning('{} is missing: run convert_cdm_to_mods.py on {} first'.format(items_sidecar_path(alias), alias))
+            quit()
+        stage['items'] = len(items)
+    with report.stage('binary pull') as stage:
+        binaries = PullInBinaries(alias, cdm_data_dir, items, path_index).binaries
+        stage['items'] = len(binaries)
+    with report.stage('structure files'):
+        MakeStructureFile(alias, path_index)
+    with report.stage('IsCountsCorrect'):
+        IsCountsCorrect(alias, cdm_data_dir, path_index)
+    with report.stage('restriction and filetype reports'):
+        restrictions_path = report_restricted_files(alias, items, path_index.catalog)
+        if restrictions_path:
+            report.wrote(restrictions_path)
+        report_filetype(alias, items)
+    with report.stage('zipping') as stage:
+        zips = make_zips(alias, binaries)
+        stage['items'], stage['bytes'] = len(zips), sum(os.path.getsize(i) for i in zips)
+        for zip_path in zips:
+            report.wrote(zip_path)
+    with report.stage('cleanup leftover files') as stage:
+        stage['bytes'] = tree_size(os.path.join('output', '{}_simples'.format(alias))) + tree_size(os.path.join('output', '{}_compounds'.format(alias)))
+        cleanup_leftover_files(alias)
+    report.write(prometheus_dir)
+    fix_permissions(report.written)
 
 
 if __name__ == '__main__':
     logging_string = setup_logging()
-    try:
-        alias = sys.argv[1]
-        cdm_data_dir = sys.argv[2]
-    except IndexError:
-        logging.warning('')
-        logging.warning('Change to: "python post_cdmconversion_cleanup.py $aliasname $path/to/U-Drive/Cached_Cdm_files"')
-        logging.warning('')
-        quit()
+    parser = argparse.ArgumentParser(usage='python post_cdm_cleanup.py $aliasname $path/to/U-Drive/Cached_Cdm_files [--prometheus-dir DIR]')
+    parser.add_argument('alias')
+    parser.add_argument('cdm_data_dir')
+    parser.add_argument('--prometheus-dir', default=None, help='also write the run report as a prometheus textfile in this folder')
+    args = parser.parse_args()
+    alias = args.alias
     logging.info('starting {}'.format(alias))
-    main(alias, cdm_data_dir)
+    main(alias, args.cdm_data_dir, args.prometheus_dir)
     logging.info('finished {}'.format(alias))
 
     log_contents = logging_string.getvalue()
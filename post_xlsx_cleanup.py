@@ -7,27 +7,32 @@ import logging
 
 from lxml import etree as ET
 
-from utilities import parse_xlsx_file
+from utilities import parse_source
+from utilities import source_alias
 from utilities import fix_permissions
 from utilities import setup_logging
 from utilities import group_by_simple_cpd
+from utilities import folder_zip_entries
+from utilities import extension_zip_entries
+from utilities import write_zips
 
 
 def main(xlsx_path):
-    alias = os.path.splitext(os.path.split(xlsx_path)[-1])[0]
-    _, metadata, _ = parse_xlsx_file(xlsx_path)
+    alias = source_alias(xlsx_path)
+    _, metadata, _ = parse_source(xlsx_path)
     simples, compounds = group_by_simple_cpd(metadata)
-    pull_in_binaries(xlsx_path, simples, compounds)
+    binaries = pull_in_binaries(xlsx_path, simples, compounds)
     make_structurefiles(compounds, alias)
-    report_filetype(alias)
-    folder_by_extension(alias)
-    make_zips(alias)
+    report_filetype(binaries)
+    zips = make_zips(alias, binaries)
     cleanup_leftover_files(alias)
-    fix_permissions()
+    fix_permissions(zips)
+
 
 def pull_in_binaries(xlsx_path, simples, compounds):
-    source_root, xlsx_file = os.path.split(xlsx_path)
-    alias = os.path.splitext(xlsx_file)[0]
+    # returns {path the binary has in final_format: source binary}; make_zips reads the sources, so nothing is copied
+    alias = source_alias(xlsx_path)
+    staging = []
     for metadata in simples:
         kind = 'simple'
         sourcepath = os.path.join(
@@ -39,7 +44,7 @@ def pull_in_binaries(xlsx_path, simples, compounds):
             f"{alias}_simples",
             'final_format'
         )
-        copy_binary(kind, sourcepath, outroot)
+        staging.append((sourcepath, binary_destination(kind, sourcepath, outroot)))
     for parent, child_objects in compounds.items():
         for child, metadata in child_objects.items():
             if child == 'parent':  # parent root items have no binaries to move
@@ -56,24 +61,25 @@ def pull_in_binaries(xlsx_path, simples, compounds):
                 f"{metadata['Parent']}",
                 f"{metadata['Child']}"
             )
-            copy_binary(kind, sourcepath, outroot)
+            staging.append((sourcepath, binary_destination(kind, sourcepath, outroot)))
+    # every missing binary is listed before stopping, not just the first
+    missing = [sourcepath for sourcepath, _ in staging if not os.path.isfile(sourcepath)]
+    if missing:
+        for sourcepath in missing:
+            logging.warning(f"expecting file at {sourcepath}")
+        logging.fatal(f"{len(missing)} binaries are missing \n  Program cancelled")
+        quit()
     logging.info('PullInBinaries done')
+    return {dest_file: sourcepath for sourcepath, dest_file in staging}
 
 
-def copy_binary(kind, sourcepath, outroot):
+def binary_destination(kind, sourcepath, outroot):
     sourcefile = os.path.split(sourcepath)[1]
     if kind == 'simple':
         outfile = sourcefile
     elif kind == 'compound':
         outfile = f"OBJ.{os.path.splitext(sourcefile)[1]}"
-    try:
-        shutil.copyfile(
-            sourcepath,
-            os.path.join(outroot, outfile)
-        )
-    except FileNotFoundError:
-        logging.fatal(f"expecting file at {sourcepath} \n  Program cancelled")
-        quit()
+    return os.path.join(os.path.abspath(outroot), outfile)
 
 
 def make_structurefiles(compounds, alias):
@@ -91,57 +97,24 @@ def make_structurefiles(compounds, alias):
     logging.info('make_structurefiles done')
 
 
-def report_filetype(alias):
-    filetypes = set()
-    all_binaries = []
-    simples_binaries = ["{}/{}".format(root, file)
-                        for root, _, files in os.walk('output/{}_simples/final_format'.format(alias))
-                        for file in files
-                        if '.xml' not in file]
-    all_binaries.extend(simples_binaries)
-    compounds_binaries = ["{}/{}".format(root, file)
-                          for root, _, files in os.walk('output/{}_compounds/final_format'.format(alias))
-                          for file in files
-                          if '.xml' not in file]
-    all_binaries.extend(compounds_binaries)
-    for binary_filename in all_binaries:
-        filetypes.add(binary_filename.split('.')[-1])
+def report_filetype(binaries):
+    filetypes = {binary_filename.split('.')[-1] for binary_filename in binaries}
     logging.info(f"Collection contains filetypes: {filetypes}")
 
 
-def folder_by_extension(alias):
-    starting_folder = os.path.join('output', '{}_simples'.format(alias), 'final_format')
-    if not os.path.isdir(starting_folder):
-        return
-    files = [i for i in os.listdir(starting_folder) if os.path.isfile(os.path.join(starting_folder, i))]
-    extensions = {i.split(".")[1] for i in files if i.split(".")[1] != 'xml'}
-    for extension in extensions:
-        dest_folder = os.path.join(starting_folder, extension)
-        if os.path.isdir(os.path.realpath(dest_folder)):
-            shutil.rmtree(dest_folder)
-        os.makedirs(dest_folder, exist_ok=True)
-        files_limited_to_extension = {file.split('.')[0] for file in files if file.split('.')[1] == extension}
-        files_with_extension_plus_samenames = [file for file in files if file.split('.')[0] in files_limited_to_extension]
-        for file in files_with_extension_plus_samenames:
-            shutil.copyfile(os.path.join(starting_folder, file), os.path.join(dest_folder, file))
-
-
-def make_zips(alias):
+def make_zips(alias, binaries):
+    zips = dict()
     os.makedirs('Upload_to_Islandora', exist_ok=True)
     cpd_output = 'output/{}_compounds/final_format'.format(alias)
     if os.path.isdir(cpd_output):
-        zipfilename = 'Upload_to_Islandora/{}-cpd'.format(alias)
-        shutil.make_archive(zipfilename, 'zip', cpd_output)
-        logging.info('{}.zip created'.format(zipfilename))
-
+        zips['Upload_to_Islandora/{}-cpd.zip'.format(alias)] = folder_zip_entries(cpd_output, binaries)
     simple_output = 'output/{}_simples/final_format'.format(alias)
-    if os.path.isdir(simple_output):
-        subdirs = [i for i in os.listdir(simple_output) if os.path.isdir(os.path.join(simple_output, i))]
-        for subdir in subdirs:
-            subdir_path = os.path.join(simple_output, subdir)
-            zipfilename = 'Upload_to_Islandora/{}-{}'.format(alias, subdir)
-            shutil.make_archive(zipfilename, 'zip', subdir_path)
-            logging.info('{}.zip created'.format(zipfilename))
+    for extension, entries in extension_zip_entries(simple_output, binaries).items():
+        zips['Upload_to_Islandora/{}-{}.zip'.format(alias, extension)] = entries
+    written = write_zips(zips)
+    for zip_path in written:
+        logging.info('{} created'.format(zip_path))
+    return written
 
 
 def cleanup_leftover_files(alias):
@@ -161,7 +134,7 @@ if __name__ == '__main__':
         xlsx_path = sys.argv[1]
     except IndexError:
         logging.warning('')
-        logging.warning('Change to: "python post_xlsx_cleanup.py $path/to/{filename}.xlsx"')
+        logging.warning('Change to: "python post_xlsx_cleanup.py $path/to/{filename}.xlsx" or "python post_xlsx_cleanup.py $path/to/{alias}/"')
         logging.warning('')
         quit()
     logging.info(f"starting {xlsx_path}")
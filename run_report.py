@@ -0,0 +1,140 @@
+#! /usr/bin/env python3
+
+import io
+import os
+import json
+import time
+import socket
+import resource
+import logging
+from contextlib import contextmanager
+
+
+class RunReport():
+    # Wall time, cpu time, memory, items and bytes for each stage of one script's run on one alias.
+    # Written to output/{alias}_{script}_report.json, and optionally as a prometheus textfile.
+    # profile_stage names a stage (or the start of several stages' names) to run under cProfile.
+    # written collects every path the run creates, so fix_permissions can run on exactly those after the last write.
+    def __init__(self, alias, script, profile_stage=None):
+        self.alias = alias
+        self.script = script
+        self.profile_stage = profile_stage
+        self.started = time.time()
+        self.start_cpu = cpu_seconds()
+        self.stages = []
+        self.slowest_pointers = None
+        self.written = []
+
+    @contextmanager
+    def stage(self, name, items=None):
+        # the caller may fill in stage['items'] and stage['bytes'] inside the block
+        stage = {'name': name, 'items': items, 'bytes': None}
+        profiler = None
+        if self.is_profiled(name):
+            import cProfile
+            profiler = cProfile.Profile()
+        start, start_cpu = time.time(), cpu_seconds()
+        if profiler:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler:
+                profiler.disable()
+            stage['wall_seconds'] = round(time.time() - start, 4)
+            stage['cpu_seconds'] = round(cpu_seconds() - start_cpu, 4)
+            stage.update(peak_rss_kb())
+            if profiler:
+                stage['profile'] = self.write_profile(name, profiler)
+            self.stages.append(stage)
+
+    def wrote(self, path):
+        if path not in self.written:
+            self.written.append(path)
+        return path
+
+    def is_profiled(self, name):
+        return bool(self.profile_stage) and name.startswith(self.profile_stage)
+
+    def write_profile(self, name, profiler):
+        # the .prof file opens in snakeviz or pstats; the top of it goes to the log
+        import pstats
+        profile_path = os.path.join('output', '{}_{}_{}.prof'.format(self.alias, self.script, name.replace(' ', '_')))
+        os.makedirs('output', exist_ok=True)
+        profiler.dump_stats(profile_path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(25)
+        logging.info('profile of {}, saved to {}:\n{}'.format(name, profile_path, summary.getvalue()))
+        return self.wrote(profile_path)
+
+    def add_stage(self, name, seconds, items=None, nbytes=None):
+        # for time measured elsewhere, e.g. summed over saxon's threads
+        self.stages.append({'name': name, 'items': items, 'bytes': nbytes, 'wall_seconds': round(seconds, 4)})
+
+    def as_dict(self):
+        report = {'alias': self.alias,
+                  'script': self.script,
+                  'host': socket.gethostname(),
+                  'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                  'wall_seconds': round(time.time() - self.started, 4),
+                  'cpu_seconds': round(cpu_seconds() - self.start_cpu, 4),
+                  'stages': self.stages, }
+        report.update(peak_rss_kb())
+        if self.slowest_pointers is not None:
+            report['slowest_pointers'] = self.slowest_pointers
+        return report
+
+    def write(self, prometheus_dir=None):
+        report = self.as_dict()
+        report_path = os.path.join('output', '{}_{}_report.json'.format(self.alias, self.script))
+        os.makedirs('output', exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(report, indent=1))
+        logging.info('{} run report written to {}'.format(self.script, report_path))
+        if prometheus_dir:
+            self.wrote(write_prometheus_textfile(report, prometheus_dir))
+        return self.wrote(report_path)
+
+
+def cpu_seconds():
+    # children only count once they have been waited for: pool workers and finished subprocesses
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss_kb():
+    # high-water marks so far, not per stage; children is the largest single child
+    return {'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'children_peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss, }
+
+
+def write_prometheus_textfile(report, prometheus_dir):
+    # node_exporter's textfile collector reads *.prom; written to a temp name and renamed so it never sees half a file
+    labels = 'alias="{}",script="{}"'.format(report['alias'], report['script'])
+    lines = ['# TYPE cdm_to_mods_run_seconds gauge',
+             'cdm_to_mods_run_seconds{{{}}} {}'.format(labels, report['wall_seconds']),
+             '# TYPE cdm_to_mods_run_cpu_seconds gauge',
+             'cdm_to_mods_run_cpu_seconds{{{}}} {}'.format(labels, report['cpu_seconds']),
+             '# TYPE cdm_to_mods_run_peak_rss_bytes gauge',
+             'cdm_to_mods_run_peak_rss_bytes{{{}}} {}'.format(labels, report['peak_rss_kb'] * 1024),
+             '# TYPE cdm_to_mods_run_finished_timestamp_seconds gauge',
+             'cdm_to_mods_run_finished_timestamp_seconds{{{}}} {:.0f}'.format(labels, time.time()), ]
+    for metric, key in (('stage_seconds', 'wall_seconds'), ('stage_cpu_seconds', 'cpu_seconds'),
+                        ('stage_items', 'items'), ('stage_bytes', 'bytes')):
+        lines.append('# TYPE cdm_to_mods_{} gauge'.format(metric))
+        for stage in report['stages']:
+            if stage.get(key) is not None:
+                stage_name = stage['name'].replace('\\', '\\\\').replace('"', '\\"')
+                lines.append('cdm_to_mods_{}{{{},stage="{}"}} {}'.format(metric, labels, stage_name, stage[key]))
+    os.makedirs(prometheus_dir, exist_ok=True)
+    textfile = os.path.join(prometheus_dir, 'cdm_to_mods_{}_{}.prom'.format(report['alias'], report['script']))
+    with open('{}.tmp'.format(textfile), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace('{}.tmp'.format(textfile), textfile)
+    return textfile
+
+
+def tree_size(folder):
+    return sum(os.path.getsize(os.path.join(root, file))
+               for root, dirs, files in os.walk(folder)
+               for file in files)
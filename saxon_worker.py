@@ -0,0 +1,242 @@
+#! /usr/bin/env python3
+
+import os
+import time
+import subprocess
+import threading
+import atexit
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from utilities import link_or_copy
+
+
+SAXON_JAR = 'saxon9he.jar'
+WORKER_SOURCE = os.path.join('java', 'SaxonChain.java')
+MIN_FILES_PER_SHARD = 200
+MAX_SHARDS = None  # batch_convert_cdm.py lowers this so parallel aliases don't each claim every core
+
+
+class SaxonWorkerError(Exception):
+    pass
+
+
+class SaxonWorker():
+    # One JVM running java/SaxonChain.java; stylesheets stay compiled between requests.
+    def __init__(self):
+        try:
+            self.process = subprocess.Popen(['java', '-cp', SAXON_JAR, WORKER_SOURCE],
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            universal_newlines=True,
+                                            encoding='utf-8')
+        except OSError as e:
+            raise SaxonWorkerError('could not start java: {}'.format(e))
+        if self.process.stdout.readline().strip() != 'READY':
+            self.close()
+            raise SaxonWorkerError('{} did not start'.format(WORKER_SOURCE))
+
+    def transform(self, xslt_paths, source_file, dest_file):
+        # returns (error message or None, seconds spent in each xslt)
+        request = '{}\t{}\t{}\n'.format('|'.join(xslt_paths), source_file, dest_file)
+        try:
+            self.process.stdin.write(request)
+            self.process.stdin.flush()
+            answer = self.process.stdout.readline()
+        except OSError as e:
+            raise SaxonWorkerError('saxon worker stopped: {}'.format(e))
+        if not answer:
+            raise SaxonWorkerError('saxon worker stopped')
+        status, _, message = (answer.rstrip('\n').split('\t', 2) + ['', ''])[:3]
+        if status == 'OK':
+            return None, [int(i) / 1e9 for i in message.split(',') if i]
+        return message or 'unknown saxon error', []
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+idle_workers = []
+idle_workers_lock = threading.Lock()
+
+
+def acquire_worker():
+    with idle_workers_lock:
+        if idle_workers:
+            return idle_workers.pop()
+    return SaxonWorker()
+
+
+def release_worker(worker):
+    with idle_workers_lock:
+        idle_workers.append(worker)
+
+
+@atexit.register
+def close_idle_workers():
+    with idle_workers_lock:
+        while idle_workers:
+            idle_workers.pop().close()
+
+
+def run_saxon(output_dir, xslts, cpd_or_simple, debug=False, shards=None, report=None):
+    # returns {flat name: final_format path} for every document saxon produced;
+    # each xslt's time, summed over the shards, goes to the run report
+    documents = map_documents(output_dir, cpd_or_simple)
+    step_seconds = [0.0] * len(xslts)
+    if not debug:
+        try:
+            finished = run_saxon_chain(documents, xslts, cpd_or_simple, shards, step_seconds)
+        except SaxonWorkerError as e:
+            logging.warning('{}; falling back to one saxon run per xslt'.format(e))
+            step_seconds = [0.0] * len(xslts)
+            debug = True
+    if debug:
+        finished = run_saxon_steps(output_dir, documents, xslts, cpd_or_simple, shards, step_seconds)
+    if report is not None:
+        for xslt, seconds in zip(xslts, step_seconds):
+            report.add_stage('saxon {} {}'.format(cpd_or_simple, xslt), seconds, items=len(documents))
+    return finished
+
+
+def map_documents(output_dir, cpd_or_simple):
+    # flat name -> (original_format path, final_format path);
+    # compounds are named by their folders, parent_child.xml, since xlsx children repeat across parents
+    orig_format_dir = os.path.join(output_dir, 'original_format')
+    final_format_dir = os.path.join(output_dir, 'final_format')
+    documents = dict()
+    for root, dirs, files in os.walk(orig_format_dir):
+        for file in files:
+            if '.xml' not in file:
+                continue
+            source_file = os.path.join(root, file)
+            if cpd_or_simple == 'simple':
+                flat_name = file
+                dest_file = os.path.join(final_format_dir, file)
+            else:
+                relative_dir = os.path.relpath(root, orig_format_dir)
+                flat_name = '{}.xml'.format(relative_dir.replace(os.sep, '_'))
+                dest_file = os.path.join(final_format_dir, relative_dir, 'MODS.xml')
+            documents[flat_name] = (source_file, dest_file)
+    return documents
+
+
+def count_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def split_into_shards(files, shards=None):
+    # a JVM costs about a second to start, so a shard is only worth it with enough files to fill it
+    if not shards:
+        shards = min(MAX_SHARDS or count_cpus(), -(-len(files) // MIN_FILES_PER_SHARD))
+    shards = max(1, min(shards, len(files)))
+    return [files[i::shards] for i in range(shards)]
+
+
+def run_shards(function, shard_lists):
+    if len(shard_lists) == 1:
+        return [function(shard_lists[0])]
+    with ThreadPoolExecutor(max_workers=len(shard_lists)) as executor:
+        return list(executor.map(function, shard_lists))
+
+
+def run_saxon_chain(documents, xslts, cpd_or_simple, shards=None, step_seconds=None):
+    # every document goes through the whole chain in one JVM per shard, straight into final_format
+    xslt_paths = [os.path.abspath(os.path.join('xsl', '{}.xsl'.format(xslt))) for xslt in xslts]
+    files = sorted(documents)
+    shard_lists = split_into_shards(files, shards)
+    logging.info('doing {} saxon {} ({} shards)'.format(cpd_or_simple.title(), ', '.join(xslts), len(shard_lists)))
+
+    def transform_shard(shard_files):
+        failures = []
+        shard_seconds = [0.0] * len(xslts)
+        if not shard_files:
+            return failures, shard_seconds
+        worker = acquire_worker()
+        try:
+            for file in shard_files:
+                source_file, dest_file = documents[file]
+                os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+                error, seconds = worker.transform(xslt_paths, os.path.abspath(source_file), os.path.abspath(dest_file))
+                for num, step in enumerate(seconds[:len(xslts)]):
+                    shard_seconds[num] += step
+                if error:
+                    if os.path.isfile(dest_file):
+                        os.remove(dest_file)
+                    failures.append((file, error))
+        except SaxonWorkerError:
+            worker.close()
+            raise
+        release_worker(worker)
+        return failures, shard_seconds
+
+    failed = set()
+    for failures, shard_seconds in run_shards(transform_shard, shard_lists):
+        for file, error in failures:
+            logging.warning('{} saxon failed on {}: {}'.format(cpd_or_simple.title(), file, error))
+            failed.add(file)
+        if step_seconds is not None:
+            for num, seconds in enumerate(shard_seconds):
+                step_seconds[num] += seconds
+    return {file: documents[file][1] for file in files if file not in failed}
+
+
+def run_saxon_steps(output_dir, documents, xslts, cpd_or_simple, shards=None, step_seconds=None):
+    # one JVM per xslt per shard, each step written to its own directory -- slow, but handy for debugging an xslt
+    starting_dir = os.path.join(output_dir, 'presaxon_flattened')
+    os.makedirs(starting_dir, exist_ok=True)
+    for file, (source_file, _) in documents.items():
+        link_or_copy(source_file, os.path.join(starting_dir, file))
+    shard_lists = split_into_shards(sorted(documents), shards)
+    logging.info('doing {} saxon {} one step at a time ({} shards)'.format(cpd_or_simple.title(), ', '.join(xslts), len(shard_lists)))
+
+    def transform_shard(numbered_shard):
+        num, shard_files = numbered_shard
+        if len(shard_lists) == 1:
+            shard_dir, shard_start_dir = output_dir, starting_dir
+        else:
+            shard_dir = os.path.join(output_dir, 'shards', str(num))
+            shard_start_dir = os.path.join(shard_dir, 'presaxon_flattened')
+            os.makedirs(shard_start_dir, exist_ok=True)
+            for file in shard_files:
+                link_or_copy(os.path.join(starting_dir, file), os.path.join(shard_start_dir, file))
+        shard_seconds = []
+        for xslt in xslts:
+            new_dir = os.path.join(shard_dir, xslt)
+            os.makedirs(new_dir, exist_ok=True)
+            path_to_xslt = os.path.join('xsl', '{}.xsl'.format(xslt))
+            start = time.time()
+            subprocess.call(['java',
+                             '-jar',
+                             SAXON_JAR,
+                             '-s:{}'.format(shard_start_dir),
+                             '-xsl:{}'.format(path_to_xslt),
+                             '-o:{}'.format(new_dir)])
+            shard_seconds.append(time.time() - start)
+            shard_start_dir = new_dir
+        return shard_start_dir, shard_seconds
+
+    post_saxon_dir = os.path.join(output_dir, 'post-saxon')
+    os.makedirs(post_saxon_dir, exist_ok=True)
+    for shard_final_dir, shard_seconds in run_shards(transform_shard, list(enumerate(shard_lists))):
+        if step_seconds is not None:
+            for num, seconds in enumerate(shard_seconds):
+                step_seconds[num] += seconds
+        for file in os.listdir(shard_final_dir):
+            link_or_copy(os.path.join(shard_final_dir, file), os.path.join(post_saxon_dir, file))
+    finished = dict()
+    for file in sorted(os.listdir(post_saxon_dir)):
+        if file not in documents:
+            continue
+        dest_file = documents[file][1]
+        os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+        link_or_copy(os.path.join(post_saxon_dir, file), dest_file)
+        finished[file] = dest_file
+    return finished
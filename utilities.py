@@ -2,35 +2,119 @@
 # coding=utf-8
 
 import os
-import subprocess
+import csv
+import json
+import stat
 from collections import namedtuple
 import logging
 import io
+import pickle
+import hashlib
+import zipfile
+from copy import deepcopy
+from shutil import copyfile
+from concurrent.futures import ThreadPoolExecutor
 
 
 from lxml import etree as ET
-import openpyxl
+
+from cdm_catalog import CdmCatalog
+from conversion_manifest import hash_file
+
+
+XLSX_SNAPSHOT_VERSION = 1
 
 
 def parse_xlsx_file(xlsx_file):
+    # a snapshot of the last parse of this same spreadsheet is read instead, when there is one
+    snapshot = load_xlsx_snapshot(xlsx_file)
+    if snapshot:
+        return snapshot['mappings'], snapshot_items(snapshot), snapshot['xsls']
+    # openpyxl takes longer to import than the rest of a cdm run's modules together, so only xlsx runs pay for it
+    # read_only streams each sheet's rows from the file instead of building every cell up front;
+    # metadata is a generator of item dicts, and the workbook closes once it has been read through
+    import openpyxl
     try:
-        workbook = openpyxl.load_workbook(xlsx_file)
+        workbook = openpyxl.load_workbook(xlsx_file, read_only=True)
     except openpyxl.utils.exceptions.InvalidFileException:
         logging.fatal(f"'{xlsx_file}' does not appear to be a valid xlsx Excel file. \n Program cancelled")
         quit()
     mappings = parse_mappings(workbook)
-    metadata = parse_metadata(workbook)
     xsls = parse_xsls(workbook)
+    metadata = snapshot_while_reading(xlsx_file, mappings, xsls, parse_metadata(workbook))
     return mappings, metadata, xsls
 
 
+def xlsx_snapshot_path(xlsx_file):
+    alias = os.path.splitext(os.path.split(xlsx_file)[-1])[0]
+    return os.path.join('output', f"{alias}_xlsx_snapshot.pickle")
+
+
+def load_xlsx_snapshot(xlsx_file):
+    # good while the spreadsheet's size and mtime are unchanged; if only its mtime changed, the sha256 decides
+    try:
+        with open(xlsx_snapshot_path(xlsx_file), 'rb') as f:
+            snapshot = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    xlsx_stat = os.stat(xlsx_file)
+    if snapshot.get('version') != XLSX_SNAPSHOT_VERSION or snapshot['path'] != os.path.abspath(xlsx_file):
+        return None
+    if snapshot['size'] != xlsx_stat.st_size:
+        return None
+    if snapshot['mtime_ns'] != xlsx_stat.st_mtime_ns:
+        if snapshot['sha256'] != hash_file(xlsx_file):
+            return None
+        snapshot['mtime_ns'] = xlsx_stat.st_mtime_ns
+        save_xlsx_snapshot(xlsx_file, snapshot)
+    logging.info(f"read {xlsx_file} from {xlsx_snapshot_path(xlsx_file)}")
+    return snapshot
+
+
+def save_xlsx_snapshot(xlsx_file, snapshot):
+    snapshot_path = xlsx_snapshot_path(xlsx_file)
+    os.makedirs('output', exist_ok=True)
+    with open(f"{snapshot_path}.tmp", 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{snapshot_path}.tmp", snapshot_path)
+
+
+def snapshot_while_reading(xlsx_file, mappings, xsls, items):
+    # passes the items through, keeping them column by column, and saves the snapshot once the sheet is read through
+    xlsx_stat = os.stat(xlsx_file)
+    snapshot = {'version': XLSX_SNAPSHOT_VERSION,
+                'path': os.path.abspath(xlsx_file),
+                'size': xlsx_stat.st_size,
+                'mtime_ns': xlsx_stat.st_mtime_ns,
+                'sha256': hash_file(xlsx_file),
+                'mappings': mappings,
+                'xsls': xsls,
+                'keys': None,
+                'columns': None, }
+    for item in items:
+        if snapshot['keys'] is None:
+            snapshot['keys'] = list(item)
+            snapshot['columns'] = [[] for _ in snapshot['keys']]
+        for column, key in zip(snapshot['columns'], snapshot['keys']):
+            column.append(item[key])
+        yield item
+    save_xlsx_snapshot(xlsx_file, snapshot)
+
+
+def snapshot_items(snapshot):
+    if snapshot['keys'] is None:
+        return
+    for values in zip(*snapshot['columns']):
+        yield dict(zip(snapshot['keys'], values))
+
+
 def parse_mappings(workbook):
     try:
         mappings_sheet = workbook.get_sheet_by_name('Mappings')
     except KeyError:
         logging.fatal(f"""Could not find worksheet "Mappings" in the xlsx file. \n Program cancelled""")
         quit()
-    mappings = {shorten(row[0].value): row[1].value for row in mappings_sheet.iter_rows()}
+    mappings = {shorten(row[0]): row[1] for row in mappings_sheet.iter_rows(max_col=2, values_only=True)}
     return mappings
 
 
@@ -41,16 +125,16 @@ def parse_metadata(workbook):
         logging.fatal(f"""Could not find worksheet "Metadata" in the xlsx file. \n Program cancelled""")
         quit()
     max_columns = count_active_columns(sheet)
-    metadata = dict()
-    for row_num, row in enumerate(sheet.iter_rows(max_col=max_columns)):
-        if row_num == 0:
-            headers = [shorten(i.value) for i in row]
-            continue
-        values = (i.value for i in row)
-        item = dict(zip(headers, values))
-        item["Row"] = row_num + 1
-        metadata[row_num + 1] = item  # 1-indexing so that key matches spreadsheet row number
-    return metadata
+    try:
+        for row_num, row in enumerate(sheet.iter_rows(max_col=max_columns, values_only=True)):
+            if row_num == 0:
+                headers = [shorten(i) for i in row]
+                continue
+            item = dict(zip(headers, row))
+            item["Row"] = row_num + 1  # 1-indexing so that it matches the spreadsheet row number
+            yield item
+    finally:
+        workbook.close()
 
 
 def parse_xsls(workbook):
@@ -60,7 +144,7 @@ def parse_xsls(workbook):
         logging.fatal(f"""Could not find worksheet "Xsls" in the xlsx file. \n Program cancelled""")
         quit()
     max_columns = count_active_columns(sheet)
-    xsls = [i[0].value for i in sheet.iter_rows(max_col=max_columns) if i[0].value]
+    xsls = [i[0] for i in sheet.iter_rows(max_col=max_columns, values_only=True) if i[0]]
     return xsls
 
 
@@ -68,26 +152,344 @@ def shorten(fullname):
     return ''.join([i for i in fullname if i.isalnum()])
 
 
+PLAIN_SOURCE_EXTENSIONS = ('.csv', '.tsv', '.jsonl')
+
+
+def source_alias(source_path):
+    return os.path.splitext(os.path.split(os.path.normpath(source_path))[-1])[0]
+
+
+def parse_source(source_path):
+    # an .xlsx workbook, or a folder holding the same three sheets as Mappings, Metadata and Xsls .csv/.tsv/.jsonl files
+    if os.path.isdir(source_path):
+        return parse_plain_source(source_path)
+    return parse_xlsx_file(source_path)
+
+
+def parse_plain_source(folder):
+    # gives what parse_xlsx_file gives, with metadata streamed the same way
+    mappings = {shorten(row[0]): row[1] for row in read_plain_rows(find_plain_sheet(folder, 'Mappings')) if row}
+    xsls = [row[0] for row in read_plain_rows(find_plain_sheet(folder, 'Xsls')) if row and row[0]]
+    metadata = parse_plain_metadata(find_plain_sheet(folder, 'Metadata'))
+    return mappings, metadata, xsls
+
+
+def find_plain_sheet(folder, name):
+    for extension in PLAIN_SOURCE_EXTENSIONS:
+        filepath = os.path.join(folder, f"{name}{extension}")
+        if os.path.isfile(filepath):
+            return filepath
+    logging.fatal(f"Could not find {name}.csv, {name}.tsv or {name}.jsonl in {folder}. \n Program cancelled")
+    quit()
+
+
+def read_plain_rows(filepath):
+    # csv and tsv rows are lists, with empty cells as None as openpyxl gives them;
+    # a jsonl line is a list for Mappings and Xsls, and an object of column: value for Metadata
+    extension = os.path.splitext(filepath)[1]
+    with open(filepath, 'r', encoding='utf-8-sig', newline='') as f:
+        if extension == '.jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.reader(f, delimiter='\t' if extension == '.tsv' else ','):
+                yield [i if i != '' else None for i in row]
+
+
+def parse_plain_metadata(filepath):
+    rows = read_plain_rows(filepath)
+    if filepath.endswith('.jsonl'):
+        # numbered as if the first line were the spreadsheet's header row
+        for row_num, row in enumerate(rows, start=2):
+            item = {shorten(k): v if v != '' else None for k, v in row.items()}
+            item["Row"] = row_num
+            yield item
+        return
+    headers = next(rows, [])
+    columns = [(num, shorten(header)) for num, header in enumerate(headers) if header]
+    for row_num, row in enumerate(rows, start=2):
+        item = {header: row[num] if num < len(row) else None for num, header in columns}
+        item["Row"] = row_num
+        yield item
+
+
 def count_active_columns(worksheet):
-    row_1 = [i for i in worksheet.iter_rows(min_row=1, max_row=1)][0]
-    return len({cell.value for cell in row_1}) - 1
-
-
-def fix_permissions():
-    all_files = [
-        os.path.join(root, file)
-        for root, dirs, files in os.walk('../cDM_to_mods/')
-        for file in files
-    ]
-    all_dirs = [
-        os.path.join(root, dir)
-        for root, dirs, files in os.walk('../cDM_to_mods')
-        for dir in dirs
-    ]
-    for file in all_files:
-        subprocess.run(['chmod', '664', file])
-    for dir in all_dirs:
-        subprocess.run(['chmod', '775', dir])
+    row_1 = next(worksheet.iter_rows(min_row=1, max_row=1, values_only=True))
+    return len(set(row_1)) - 1
+
+
+class MappingTemplate:
+    # A mapping cell parsed once; render() clones it and fills the %value% slots.
+    placeholder = '%value%'
+
+    def __init__(self, source):
+        self.source = source
+        self.element = ET.fromstring(source)
+        self.slots = []
+        self.find_slots(self.element, ())
+
+    def __reduce__(self):
+        return (MappingTemplate, (self.source, ))
+
+    def find_slots(self, elem, path):
+        for attrib_name, attrib_value in elem.attrib.items():
+            if self.placeholder in attrib_value:
+                self.slots.append((path, attrib_name))
+        if elem.text and self.placeholder in elem.text:
+            self.slots.append((path, 'text'))
+        for num, child in enumerate(elem):
+            if child.tail and self.placeholder in child.tail:
+                self.slots.append((path + (num, ), 'tail'))
+            self.find_slots(child, path + (num, ))
+
+    def render(self, value=None):
+        elem = deepcopy(self.element)
+        if value is None:
+            return elem
+        # match what the xml parser made of the old escaped-and-reparsed strings
+        value = value.replace('\r\n', '\n').replace('\r', '\n')
+        for path, where in self.slots:
+            target = elem
+            for num in path:
+                target = target[num]
+            if where == 'text':
+                target.text = target.text.replace(self.placeholder, value)
+            elif where == 'tail':
+                target.tail = target.tail.replace(self.placeholder, value)
+            else:
+                attrib_value = value.replace('\n', ' ').replace('\t', ' ')
+                target.set(where, target.get(where).replace(self.placeholder, attrib_value))
+        return elem
+
+
+def compile_mappings(mappings):
+    templates = dict()
+    for k, v in mappings.items():
+        if not v:
+            continue
+        try:
+            templates[k] = MappingTemplate(v)
+        except ET.XMLSyntaxError:
+            raise ValueError(f"{k} {v} in mapping is malformed.")
+    return templates
+
+
+def merge_same_fields(orig_etree):
+    # children of every later top level element with the same tag and attributes move into the first one,
+    # each landing before that element's last child
+    firsts = dict()
+    for elem in list(orig_etree):
+        first = firsts.setdefault((elem.tag, frozenset(elem.attrib.items())), elem)
+        children = list(elem)
+        if first is elem or not children:
+            continue
+        if len(first):
+            last_child = first[-1]
+        else:
+            last_child = children.pop(0)
+            first.append(last_child)
+        for child in children:
+            last_child.addprevious(child)
+    return orig_etree
+
+
+# (parent tag, child tags): each child's text is split on ';' into its own copy of the parent.
+# Order matters, it is the order the splits are applied in.
+SPLIT_RULES = (
+    ('name', ('namePart', )),
+    ('subject', ('topic', 'geographic', 'temporal', 'occupation', )),
+    ('hierarchicalGeographic', ('continent', 'country', 'province', 'region', 'state', 'territory',
+                                'county', 'city', 'citySection', 'island', 'area', )),
+)
+# the spreadsheet converter has never split subject/occupation
+XLSX_SPLIT_RULES = tuple((parent_tag, tuple(child_tag for child_tag in child_tags if child_tag != 'occupation'))
+                         for parent_tag, child_tags in SPLIT_RULES)
+
+
+def split_fields(root_element, split_rules=SPLIT_RULES):
+    # Same result as splitting rule by rule over the whole tree, but each parent's children
+    # are worked out once, innermost first, and copies are only made of the finished pieces.
+    passes = [(parent_tag, child_tag) for parent_tag, child_tags in split_rules for child_tag in child_tags]
+    parent_tags = {parent_tag for parent_tag, _ in split_rules}
+    containers, seen = [], set()
+    for elem in root_element.iter(*parent_tags):
+        container = elem.getparent()
+        if container not in seen:
+            seen.add(container)
+            containers.append(container)
+    # a container shows up before anything nested in its splittable children
+    for container in reversed(containers):
+        split_children(container, passes, parent_tags)
+    return root_element
+
+
+def split_children(container, passes, parent_tags):
+    children = list(container)
+    # matched children of every splittable child, looked up once for all passes
+    matches = dict()
+    for child in children:
+        if child.tag in parent_tags:
+            for i in child:
+                matches.setdefault((child, i.tag), []).append(i)
+    active_passes = [(parent_tag, child_tag) for parent_tag, child_tag in passes
+                     if any(elem.tag == parent_tag and tag == child_tag for elem, tag in matches)]
+    if not active_passes:
+        return
+    # an item is (original elem, ((matched child, split text), ...)); each pass keeps the unsplit
+    # items in place and moves the split ones to the end, like the old append-and-remove did
+    items = [(child, ()) for child in children]
+    for parent_tag, child_tag in active_passes:
+        kept, split_items = [], []
+        for elem, pieces in items:
+            if elem.tag != parent_tag or (elem, child_tag) not in matches:
+                kept.append((elem, pieces))
+                continue
+            for match in matches[(elem, child_tag)]:
+                for split in (match.text or '').split(';'):
+                    split = split.strip()
+                    if split:
+                        split_items.append((elem, pieces + ((match, split), )))
+        items = kept + split_items
+    for child in children:
+        container.remove(child)
+    for elem, pieces in items:
+        container.append(make_split_copy(elem, pieces) if pieces else elem)
+
+
+def make_split_copy(elem, pieces):
+    # lxml's __copy__ is already deep, and skips copy.deepcopy's memo bookkeeping
+    copied_elem = elem.__copy__()
+    split_tags = {match.tag for match, _ in pieces}
+    for i in [i for i in copied_elem if i.tag in split_tags]:
+        copied_elem.remove(i)
+    for match, split in pieces:
+        new_child_elem = match.__copy__()
+        new_child_elem.text = split
+        copied_elem.insert(0, new_child_elem)
+    return copied_elem
+
+
+def link_or_copy(source_file, dest_file):
+    # a hardlink costs no io; copy when the two paths can't share an inode
+    if os.path.lexists(dest_file):
+        os.remove(dest_file)
+    try:
+        os.link(source_file, dest_file)
+    except OSError:
+        copyfile(source_file, dest_file)
+
+
+ZIP_THREADS = 8
+
+
+# already compressed; deflating them again costs cpu and saves nothing
+ZIP_STORED_EXTENSIONS = ('jp2', 'mp4', 'mp3', 'pdf', 'zip')
+
+
+def folder_zip_entries(folder, binaries=None):
+    # (name in zip, file to read) for what shutil.make_archive would put in a zip of folder, directories included.
+    # binaries maps paths inside folder that were never copied there to the source files to read instead.
+    folder = os.path.abspath(folder)
+    entries = dict()
+    for root, dirs, files in os.walk(folder):
+        if root != folder:
+            entries['{}/'.format(os.path.relpath(root, folder).replace(os.sep, '/'))] = root
+        for file in files:
+            entries[os.path.relpath(os.path.join(root, file), folder).replace(os.sep, '/')] = os.path.join(root, file)
+    for dest_file, source_file in (binaries or dict()).items():
+        if dest_file.startswith(folder + os.sep):
+            entries[os.path.relpath(dest_file, folder).replace(os.sep, '/')] = source_file
+    return sorted(entries.items())
+
+
+def extension_zip_entries(folder, binaries=None):
+    # {extension: (name in zip, file to read)}: each simples zip holds one extension's binaries plus the mods
+    # of the same pointers.  binaries are {path in folder: source file} for binaries never copied there.
+    folder = os.path.abspath(folder)
+    if not os.path.isdir(folder):
+        return dict()
+    files = {i: os.path.join(folder, i) for i in os.listdir(folder) if os.path.isfile(os.path.join(folder, i))}
+    files.update({os.path.split(dest_file)[1]: source_file for dest_file, source_file in (binaries or dict()).items()
+                  if os.path.split(dest_file)[0] == folder})
+    extensions = {i.split(".")[1] for i in files if i.split(".")[1] != 'xml'}
+    groups = dict()
+    for extension in extensions:
+        files_limited_to_extension = {file.split('.')[0] for file in files if file.split('.')[1] == extension}
+        groups[extension] = sorted((file, filepath) for file, filepath in files.items() if file.split('.')[0] in files_limited_to_extension)
+    return groups
+
+
+def write_zip(zip_path, entries):
+    # ZipFile.write streams each file through in chunks, so nothing is held in memory whole
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for arcname, filepath in entries:
+            extension = os.path.splitext(arcname)[1].lstrip('.').lower()
+            compression = zipfile.ZIP_STORED if extension in ZIP_STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            zip_file.write(filepath, arcname, compression)
+    return zip_path
+
+
+def write_zips(zips, workers=ZIP_THREADS):
+    # {zip path: entries}; the zips share nothing, so they are written side by side
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda item: write_zip(*item), sorted(zips.items())))
+
+
+FILE_MODE, DIR_MODE = 0o664, 0o775
+
+
+def alias_output_paths(alias):
+    return [os.path.join('output', '{}_{}'.format(alias, kind)) for kind in ('simples', 'compounds')]
+
+
+def items_sidecar_path(alias):
+    return os.path.join('output', '{}_items.jsonl'.format(alias))
+
+
+def write_items_sidecar(alias, items):
+    # a json line per converted pointer, noted while its json was parsed anyway: kind, parent, final mods path,
+    # filetype and source binary.  post_cdm_cleanup's reports read this instead of the mods and folders.
+    sidecar_path = items_sidecar_path(alias)
+    os.makedirs('output', exist_ok=True)
+    with open('{}.tmp'.format(sidecar_path), 'w', encoding='utf-8') as f:
+        for item in items:
+            f.write('{}\n'.format(json.dumps(item, sort_keys=True)))
+    os.replace('{}.tmp'.format(sidecar_path), sidecar_path)
+    return sidecar_path
+
+
+def read_items_sidecar(alias):
+    sidecar_path = items_sidecar_path(alias)
+    if not os.path.isfile(sidecar_path):
+        return []
+    with open(sidecar_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def fix_permissions(paths):
+    # 664 for files and 775 for folders, on the paths a run wrote and everything under them.
+    # A path that already has its mode is left alone, and symlinks are never followed.
+    pending = list(paths)
+    checked, changed = 0, 0
+    while pending:
+        path = pending.pop()
+        try:
+            path_stat = os.lstat(path)
+        except FileNotFoundError:
+            continue
+        if stat.S_ISLNK(path_stat.st_mode):
+            continue
+        checked += 1
+        if stat.S_ISDIR(path_stat.st_mode):
+            mode = DIR_MODE
+            pending.extend(os.path.join(path, i) for i in os.listdir(path))
+        else:
+            mode = FILE_MODE
+        if stat.S_IMODE(path_stat.st_mode) != mode:
+            os.chmod(path, mode)
+            changed += 1
+    logging.info('fix_permissions: {} of {} paths changed'.format(changed, checked))
 
 
 def setup_logging():
@@ -109,9 +511,13 @@ def setup_logging():
 
 
 def group_by_simple_cpd(metadata):
+    # metadata is an iterable of item dicts in spreadsheet row order, read once
     simples, compounds = list(), dict()
     child_of = False
-    for row_num, item_metadata in sorted(metadata.items()):
+    items = iter(metadata)
+    next_item = next(items, None)
+    while next_item is not None:
+        item_metadata, next_item = next_item, next(items, None)
 
         # Logic of this function --
         # if this row has nothing in the Child cell
@@ -130,8 +536,8 @@ def group_by_simple_cpd(metadata):
 
         if (
             not item_metadata['Child'] and
-            metadata.get(row_num + 1) and
-            metadata.get(row_num + 1)['Child']
+            next_item and
+            next_item['Child']
         ):
             child_of = item_metadata['Identifier']
             # catch fire if overlapping parent ids
@@ -151,23 +557,120 @@ def group_by_simple_cpd(metadata):
     return simples, compounds
 
 
+class CdmPathIndex:
+    # A Cached_Cdm_files/{alias} tree indexed by pointer, read from its CdmCatalog rather than walked.
+    def __init__(self, alias_data_dir, catalog=None, full_scan=False):
+        self.alias_data_dir = alias_data_dir
+        self.catalog = catalog or CdmCatalog(alias_data_dir, full_scan)
+        self.json_paths = dict()
+        self.structure_files = dict()
+        self.binaries = dict()
+        self.elems_in_collection = []
+        self.main()
+
+    def main(self):
+        for kind, pointer, filepath in self.catalog.files():
+            if kind == 'elems':
+                self.elems_in_collection.append(filepath)
+            elif kind == 'json':
+                self.json_paths.setdefault(pointer, []).append(filepath)
+            elif kind == 'structure':
+                self.structure_files.setdefault(pointer, []).append(filepath)
+            elif kind == 'binary':
+                self.binaries.setdefault(pointer, []).append(os.path.split(filepath))
+
+    def json_path(self, pointer):
+        paths = self.json_paths.get(pointer)
+        if not paths:
+            return None
+        if len(paths) > 1:
+            logging.warning('pointer {} has multiple source json files, using {}: {}'.format(pointer, paths[0], paths[1:]))
+        return paths[0]
+
+    def structure_file(self, pointer):
+        paths = self.structure_files.get(pointer)
+        if not paths:
+            return None
+        return paths[0]
+
+    def all_structure_files(self):
+        return [path for paths in self.structure_files.values() for path in paths]
+
+    def root_elems_in_collection(self):
+        return [path for path in self.elems_in_collection
+                if os.path.dirname(path) == self.alias_data_dir]
+
+    def duplicate_binaries(self):
+        return {pointer for pointer, paths in self.binaries.items() if len(paths) > 1}
+
+
+class StructureCache:
+    # Each {pointer}_cpd.xml's type, children, sha256 and the titles a Monograph gives its pages, as the
+    # CdmCatalog parsed them when the file was added or last changed.
+    def __init__(self, path_index):
+        self.path_index = path_index
+        self.alias_data_dir = path_index.alias_data_dir
+        self.structures = dict()
+
+    def structure(self, structure_file):
+        key = os.path.relpath(structure_file, self.alias_data_dir)
+        if key not in self.structures:
+            entry = self.path_index.catalog.structure(structure_file)
+            # a structure file outside the cataloged tree, e.g. a compound's structure.cpd in output/
+            self.structures[key] = entry if entry is not None else self.parse(structure_file)
+        return self.structures[key]
+
+    def children(self, pointer):
+        return self.path_index.catalog.children(pointer)
+
+    def sha256(self, structure_file):
+        # hashed from the bytes the catalog parsed, so the conversion manifest needn't read the file again
+        return self.structure(structure_file)['sha256']
+
+    @staticmethod
+    def parse(structure_file):
+        with open(structure_file, 'rb') as f:
+            structure_bytes = f.read()
+        root_elem = ET.fromstring(structure_bytes, base_url=structure_file)
+        type_elem = root_elem.find('type')
+        entry = {'sha256': hashlib.sha256(structure_bytes).hexdigest(),
+                 'type': type_elem.text if type_elem is not None else None,
+                 'children': [i.text for i in root_elem.iterfind('.//pageptr')],
+                 'monograph_titles': dict(),
+                 'monograph_error': None, }
+        try:
+            entry['monograph_titles'] = MonographTitleCombiner.titles_in_structure(root_elem, structure_file)
+        except Exception as e:
+            # raised again by MonographTitleCombiner whenever the cached entry is used
+            entry['monograph_error'] = str(e) or 'unexpected structure in {}'.format(structure_file)
+        return entry
+
+
 class MonographTitleCombiner:
-    def __init__(self, alias_data_dir):
+    def __init__(self, alias_data_dir, path_index=None, structure_cache=None):
         self.alias_data_dir = alias_data_dir
+        self.path_index = path_index or CdmPathIndex(alias_data_dir)
+        self.structure_cache = structure_cache or StructureCache(self.path_index)
         self.monograph_pointer_newtitle = dict()
         self.current_stucture_file = None
         self.main()
 
     def main(self):
-        structure_files = [os.path.join(root, file)
-                           for root, dirs, files in os.walk(self.alias_data_dir)
-                           for file in files
-                           if "_cpd.xml" in file]
+        structure_files = self.path_index.all_structure_files()
         for structure_file in sorted(structure_files):
-            self.current_stucture_file = structure_file
-            parsed_structure_file = ET.parse(structure_file)
-            root_elem = parsed_structure_file.getroot()
-            self.make_pointer_new_monograph_title_dict(root_elem)
+            structure = self.structure_cache.structure(structure_file)
+            if structure['monograph_error']:
+                raise Exception(structure['monograph_error'])
+            self.monograph_pointer_newtitle.update(structure['monograph_titles'])
+
+    @classmethod
+    def titles_in_structure(cls, root_elem, structure_file):
+        # the new page titles from one structure file; empty unless it is a Monograph
+        combiner = cls.__new__(cls)
+        combiner.monograph_pointer_newtitle = dict()
+        combiner.current_stucture_file = structure_file
+        combiner.make_pointer_new_monograph_title_dict(root_elem)
+        return combiner.monograph_pointer_newtitle
 
     def make_pointer_new_monograph_title_dict(self, root_elem):
         if root_elem.find('type').text != "Monograph":